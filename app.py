@@ -4,17 +4,22 @@ from flask_cors import CORS
 from salat_dz.apiv1 import blueprint as apiv1
 from salat_dz.apiv2 import blueprint as apiv2
 from salat_dz.base import blueprint as base
+from salat_dz import metrics, reload
 
 
 def register_blueprints(app):
     app.register_blueprint(apiv1)
     app.register_blueprint(apiv2)
     app.register_blueprint(base)
+    app.register_blueprint(metrics.blueprint)
+    app.register_blueprint(reload.blueprint)
     return app
 
 
 def register_extensions(app):
     CORS(app)
+    metrics.init_app(app)
+    reload.init_app(app)
     return app
 
 
@@ -0,0 +1,9 @@
+"""
+ASGI entry point, for clients keeping their connections open: uvicorn asgi:app
+(or gunicorn -k uvicorn_worker.UvicornWorker asgi:app)
+"""
+from app import app as wsgi_app
+from salat_dz.asgi import WsgiBridge
+from salat_dz.config import settings
+
+app = WsgiBridge(wsgi_app, settings.asgi.threads)
@@ -0,0 +1,80 @@
+"""
+Cold start of a worker: time to import the app and latency of its first requests, in fresh interpreters.
+
+Usage: python benchmarks/coldstart.py [--repeat 5] [--save | --check]
+
+Also fails when importing the app pulls a module only the build needs (pandas, tabula, the pdf reader),
+they would slow down every worker boot. Build the snapshot of the dataset first (`python -m salat_dz.snapshot`),
+without it the first worker parses the CSVs with pandas.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from common import ROOT, check_baselines, save_baselines
+
+SUITE = 'coldstart'
+
+# modules the web app must not import, they are only needed to build the dataset
+BUILD_ONLY_MODULES = ('pandas', 'tabula', 'salat_dz.reader', 'salat_dz.build', 'Levenshtein')
+
+FIRST_REQUESTS = [
+    ('first request v1', '/api/v1/mawaqit/?wilayas=16'),
+    ('first request v2', '/api/v2/mawaqit/?wilayas=16&salawat=next'),
+    ('first request index', '/'),
+]
+
+COLD_START = '''
+import json, sys, time
+start = time.perf_counter()
+from app import app
+timings = {{'import app': time.perf_counter() - start}}
+imported = [name for name in {build_only!r} if name in sys.modules]
+client = app.test_client()
+for name, url in {requests!r}:
+    start = time.perf_counter()
+    response = client.get(url)
+    response.get_data()
+    timings[name] = time.perf_counter() - start
+    assert response.status_code == 200, f'{{url}}: {{response.status_code}}'
+print(json.dumps({{'timings': timings, 'imported': imported}}))
+'''
+
+
+def cold_start():
+    code = COLD_START.format(build_only=BUILD_ONLY_MODULES, requests=FIRST_REQUESTS)
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    group = arg_parser.add_mutually_exclusive_group()
+    group.add_argument('--save', action='store_true', help='save the results as the new baselines')
+    group.add_argument('--check', action='store_true', help='exit with an error on regressions')
+    args = arg_parser.parse_args()
+
+    runs = [cold_start() for _ in range(args.repeat)]
+    results = {
+        name: {'median_ms': statistics.median(run['timings'][name] for run in runs) * 1000}
+        for name in runs[0]['timings']
+    }
+    for name, measures in results.items():
+        print(f'{name:25s} {measures["median_ms"]:10.2f}ms')
+
+    imported = sorted({name for run in runs for name in run['imported']})
+    if imported:
+        print(f'The app imports build-only modules: {", ".join(imported)}')
+        raise SystemExit(1)
+
+    if args.save:
+        save_baselines(SUITE, results)
+    elif args.check and not check_baselines(SUITE, results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Helpers shared by the benchmarks: timing, percentiles, memory and the stored baselines.
+
+Baselines are kept in `benchmarks/baselines.json`, one entry per measure. They depend on the machine,
+record them again (`--save`) when moving the benchmarks to another one.
+"""
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+BASELINES_FILE = os.path.join(ROOT, 'benchmarks', 'baselines.json')
+# a measure regresses when it is this much worse than its baseline
+TOLERANCE = 1.5
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]"""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def time_calls(function: Callable, number: int, repeat: int = 5) -> float:
+    """Best time of a call in seconds, over `repeat` runs of `number` calls"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def autorange(function: Callable, min_time: float = 0.2) -> int:
+    """Number of calls taking at least `min_time` seconds"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - start >= min_time:
+            return number
+        number *= 2
+
+
+def rss_kib(pid: Optional[int] = None) -> int:
+    """Resident memory of a process, the current one by default"""
+    if pid is None:
+        # the peak on this process is close enough, and portable
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def read_baselines() -> Dict[str, Dict[str, float]]:
+    if not os.path.exists(BASELINES_FILE):
+        return {}
+    with open(BASELINES_FILE) as f:
+        return json.load(f)
+
+
+def save_baselines(suite: str, results: Dict[str, Dict[str, float]]):
+    baselines = read_baselines()
+    baselines[suite] = {
+        name: {measure: float(f'{value:.4g}') for measure, value in measures.items()}
+        for name, measures in results.items()
+    }
+    with open(BASELINES_FILE, 'w') as f:
+        json.dump(baselines, f, indent=4, sort_keys=True)
+        f.write('\n')
+    print(f'Baselines of {suite} saved to {BASELINES_FILE}')
+
+
+# measures where more is better, the other ones (latencies, memory) are better when lower
+HIGHER_IS_BETTER = {'ops', 'rps', 'opened'}
+
+
+def check_baselines(suite: str, results: Dict[str, Dict[str, float]], tolerance: float = TOLERANCE) -> bool:
+    """Compare the results to the baselines of the suite, print the regressions and return whether there is none"""
+    baselines = read_baselines().get(suite, {})
+    ok = True
+    for name, measures in results.items():
+        for measure, value in measures.items():
+            baseline = baselines.get(name, {}).get(measure)
+            if not baseline:
+                continue
+            ratio = baseline / value if measure in HIGHER_IS_BETTER else value / baseline
+            if ratio > tolerance:
+                ok = False
+                print(f'REGRESSION {suite}/{name} {measure}: {value:.6g} vs baseline {baseline:.6g} ({ratio:.2f}x worse)')
+    if ok:
+        print(f'No regression in {suite} (tolerance {tolerance}x)')
+    return ok
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    return {
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'mean_ms': statistics.mean(timings) * 1000,
+    }
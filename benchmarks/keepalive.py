@@ -0,0 +1,169 @@
+"""
+Many clients keeping their connection open, e.g. dashboards and mosque screens polling the next salat.
+
+Usage: python benchmarks/keepalive.py [--connections 10 100 500 1000] [--interval 1] [--duration 10] [--streams 1000] [--save | --check]
+
+Every client opens a connection and sends a request of the query mix every `interval` seconds, reusing
+its connection when the server keeps it alive. It's run against one worker of every server: the sync
+gunicorn worker (`app:app`) and uvicorn (`asgi:app`). Reported per number of connections: the answered
+requests per second, p50/p99 latency, the errors (refused, reset or timed out) and the rss of the worker.
+
+Then `--streams` clients open the event stream of the next salat on uvicorn and keep it open for `duration`,
+reported: the rss of the worker and the cpu it used while the streams were idle.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from common import check_baselines, percentile, rss_kib, save_baselines
+from load import SERVERS, sample_queries, serve, worker_pids
+
+SUITE = 'keepalive'
+
+# a request not answered by then is an error
+TIMEOUT = 10
+
+
+async def fetch(reader, writer, url):
+    """Send a GET on the connection, returns the status and whether the server closes the connection"""
+    writer.write(f'GET {url} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode('latin-1'))
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').lower()
+    status = int(head.split(' ', 2)[1])
+    headers = dict(line.split(': ', 1) for line in head.split('\r\n')[1:] if ': ' in line)
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection') == 'close' or head.startswith('http/1.0')
+
+
+async def client(port, urls, interval, deadline, timings, errors):
+    connection = None
+    # the clients don't all start on the same tick
+    await asyncio.sleep(random.random() * interval)
+    next_request = time.perf_counter()
+    while next_request < deadline:
+        url = random.choice(urls)
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), TIMEOUT)
+            status, close = await asyncio.wait_for(fetch(*connection, url), TIMEOUT)
+            if status not in (200, 304):
+                raise ValueError(f'{url}: {status}')
+            timings.append(time.perf_counter() - start)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            errors.append(url)
+            close = True
+        if close and connection is not None:
+            connection[1].close()
+            connection = None
+        next_request += interval
+        await asyncio.sleep(max(0.0, next_request - time.perf_counter()))
+    if connection is not None:
+        connection[1].close()
+
+
+async def run_clients(port, urls, connections, interval, duration):
+    timings, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(port, urls, interval, deadline, timings, errors) for _ in range(connections)))
+    return timings, errors
+
+
+async def listen(port, url, deadline, opened):
+    """Open an event stream and read it until the deadline"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), TIMEOUT)
+    try:
+        writer.write(f'GET {url} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode('latin-1'))
+        await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), TIMEOUT)
+        await asyncio.wait_for(reader.readuntil(b'\n\n'), TIMEOUT)
+        opened.append(url)
+        while time.perf_counter() < deadline:
+            try:
+                await asyncio.wait_for(reader.read(4096), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        writer.close()
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime, in clock ticks
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def open_streams(port, process, urls, n, duration):
+    opened = []
+    deadline = time.perf_counter() + duration
+    listeners = asyncio.gather(*(listen(port, random.choice(urls), deadline, opened) for _ in range(n)), return_exceptions=True)
+    while len(opened) < n and time.perf_counter() < deadline - duration / 2:
+        await asyncio.sleep(0.1)
+    idle_start, cpu_start = time.perf_counter(), cpu_seconds(process.pid)
+    rss = rss_kib(process.pid)
+    errors = sum(isinstance(result, Exception) for result in await listeners)
+    idle_cpu = cpu_seconds(process.pid) - cpu_start
+    return {'opened': len(opened), 'errors': errors, 'rss_kib': rss, 'idle_cpu_ms': idle_cpu / (time.perf_counter() - idle_start) * 1000}
+
+
+def run_streams(n, duration):
+    """Worker cost of `n` open event streams, in ms of cpu per second while they are idle"""
+    urls = [f'/api/v2/mawaqit/stream?wilayas={code:02d}' for code in range(1, 49)]
+    with serve('uvicorn', 1) as (port, process):
+        measures = asyncio.run(open_streams(port, process, urls, n, duration))
+    print(
+        f'uvicorn  {n:5d} streams: opened={measures["opened"]} errors={measures["errors"]} '
+        f'rss={measures["rss_kib"] / 1024:.1f}MiB idle cpu={measures["idle_cpu_ms"]:.1f}ms/s'
+    )
+    return {f'uvicorn {n} streams': measures}
+
+
+def run(target, connections, interval, duration):
+    urls = [url for _, url in sample_queries(1000)]
+    results = {}
+    with serve(target, 1) as (port, process):
+        for n in connections:
+            start = time.perf_counter()
+            timings, errors = asyncio.run(run_clients(port, urls, n, interval, duration))
+            elapsed = time.perf_counter() - start
+            # uvicorn runs a single worker in its own process
+            rss = max(rss_kib(pid) for pid in worker_pids(process.pid) or [process.pid])
+            measures = {'rps': len(timings) / elapsed, 'errors': len(errors), 'rss_kib': rss}
+            if timings:
+                measures.update(p50_ms=percentile(timings, 50) * 1000, p99_ms=percentile(timings, 99) * 1000)
+            results[f'{target} {n} connections'] = measures
+            print(
+                f'{target:8s} {n:5d} connections: {measures["rps"]:7.0f} req/s '
+                f'p50={measures.get("p50_ms", 0):8.2f}ms p99={measures.get("p99_ms", 0):8.2f}ms '
+                f'errors={len(errors):5d} rss={rss / 1024:.1f}MiB'
+            )
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--connections', type=int, nargs='+', default=[10, 100, 500, 1000])
+    arg_parser.add_argument('--interval', type=float, default=1.0, help='seconds between the requests of a client')
+    arg_parser.add_argument('--duration', type=float, default=10.0, help='seconds of every run')
+    arg_parser.add_argument('--target', choices=list(SERVERS), nargs='+', default=list(SERVERS))
+    arg_parser.add_argument('--streams', type=int, default=1000, help='open event streams, 0 to skip')
+    group = arg_parser.add_mutually_exclusive_group()
+    group.add_argument('--save', action='store_true', help='save the results as the new baselines')
+    group.add_argument('--check', action='store_true', help='exit with an error on regressions')
+    args = arg_parser.parse_args()
+
+    results = {}
+    for target in args.target:
+        results.update(run(target, args.connections, args.interval, args.duration))
+    if args.streams:
+        results.update(run_streams(args.streams, args.duration))
+
+    if args.save:
+        save_baselines(SUITE, results)
+    elif args.check and not check_baselines(SUITE, results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
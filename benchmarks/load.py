@@ -0,0 +1,218 @@
+"""
+Load test of the mawaqit endpoints over a realistic query mix.
+
+Usage:
+    python benchmarks/load.py --target client [--requests 2000]
+    python benchmarks/load.py --target gunicorn [--workers 2] [--concurrency 8] [--requests 5000]
+    python benchmarks/load.py --target uvicorn [--workers 2] [--concurrency 8] [--requests 5000]
+    add --save to record the results as the new baselines, --check to fail on regressions
+
+`client` runs the app in this process with the Flask test client, `gunicorn` starts a real server
+with `app:app` and sends the requests from concurrent threads, `uvicorn` does the same with the ASGI
+entry point `asgi:app`. Reported: throughput, p50/p99 latency
+(overall and per query kind) and the resident memory of every worker.
+"""
+import argparse
+from collections import defaultdict
+import contextlib
+from datetime import datetime, timedelta
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+from common import ROOT, check_baselines, percentile, rss_kib, save_baselines, summarize
+
+SUITE = 'load'
+
+SERVERS = {
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '--workers', '{workers}', '--bind', '127.0.0.1:{port}', 'app:app'],
+    'uvicorn': [sys.executable, '-m', 'uvicorn', '--workers', '{workers}', '--port', '{port}', '--no-access-log', 'asgi:app'],
+}
+
+
+def query_mix(day):
+    """(kind, url, weight), most clients ask for today's or the next salat of one wilaya"""
+    week = (day + timedelta(days=6)).isoformat()
+    day = day.isoformat()
+    return [
+        ('v1 today', '/api/v1/mawaqit/?wilayas=الجزائر', 20),
+        ('v1 day', f'/api/v1/mawaqit/?days={day}&wilayas=الجزائر', 15),
+        ('v1 next', '/api/v1/mawaqit/?wilayas=الجزائر&salawat=next', 15),
+        ('v1 en all wilayas', f'/api/v1/mawaqit/en?days={day}', 5),
+        ('v2 today', '/api/v2/mawaqit/?wilayas=16', 10),
+        ('v2 range', f'/api/v2/mawaqit/?from={day}&to={week}&wilayas=16', 10),
+        ('v2 multi wilayas', f'/api/v2/mawaqit/?days={day}&wilayas=16,31,25,19', 10),
+        ('v2 nexts', '/api/v2/mawaqit/?wilayas=16,31&salawat=nexts', 5),
+        ('v2 all wilayas', f'/api/v2/mawaqit/?days={day}', 5),
+        ('v2 coordinates', f'/api/v2/mawaqit/?days={day}&lat=35.69&lon=-0.63', 5),
+    ]
+
+
+def sample_queries(n, seed=0):
+    from salat_dz.store import get_store
+
+    store = get_store()
+    day = store.dates[len(store.dates) // 2].astype(datetime)
+    mix = query_mix(day)
+    chooser = random.Random(seed)
+    chosen = chooser.choices(mix, weights=[weight for _, _, weight in mix], k=n)
+    return [(kind, quote(url, safe='/?=&,.:-')) for kind, url, _ in chosen]
+
+
+def report(target, timings, elapsed, rss):
+    """Print and return the results, timings are (kind, seconds)"""
+    by_kind = defaultdict(list)
+    for kind, seconds in timings:
+        by_kind[kind].append(seconds)
+
+    all_timings = [seconds for _, seconds in timings]
+    results = {f'{target} total': {'rps': len(all_timings) / elapsed, **summarize(all_timings)}}
+    for kind, kind_timings in sorted(by_kind.items()):
+        results[f'{target} {kind}'] = {'p50_ms': percentile(kind_timings, 50) * 1000, 'p99_ms': percentile(kind_timings, 99) * 1000}
+    for worker, kib in enumerate(rss):
+        results[f'{target} worker {worker}'] = {'rss_kib': kib}
+
+    total = results[f'{target} total']
+    print(f'{target}: {len(all_timings)} requests in {elapsed:.2f}s, {total["rps"]:.0f} req/s, p50={total["p50_ms"]:.2f}ms p99={total["p99_ms"]:.2f}ms')
+    for kind in sorted(by_kind):
+        measures = results[f'{target} {kind}']
+        print(f'  {kind:20s} n={len(by_kind[kind]):5d} p50={measures["p50_ms"]:8.2f}ms p99={measures["p99_ms"]:8.2f}ms')
+    for worker, kib in enumerate(rss):
+        print(f'  worker {worker} rss={kib / 1024:.1f}MiB')
+    return results
+
+
+def run_client(n):
+    from app import app
+
+    client = app.test_client()
+    queries = sample_queries(n)
+    timings = []
+    start = time.perf_counter()
+    for kind, url in queries:
+        request_start = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        timings.append((kind, time.perf_counter() - request_start))
+        assert response.status_code in (200, 304), f'{url}: {response.status_code}'
+    elapsed = time.perf_counter() - start
+    return report('client', timings, elapsed, [rss_kib()])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def worker_pids(master):
+    pids = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                # the command may contain spaces, the parent pid follows the closing parenthesis
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == master:
+            pids.append(int(pid))
+    return sorted(pids)
+
+
+def wait_ready(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/api/v2/swagger.json')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f'The server did not answer on port {port}')
+
+
+@contextlib.contextmanager
+def serve(target, workers):
+    """Start the server of the target, yields its port and its process"""
+    port = free_port()
+    command = [part.format(port=port, workers=workers) for part in SERVERS[target]]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        yield port, process
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def run_server(target, n, workers, concurrency):
+    with serve(target, workers) as (port, process):
+        queries = sample_queries(n)
+        timings = []
+        lock = threading.Lock()
+        position = iter(range(n))
+
+        def send():
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            local = []
+            while True:
+                with lock:
+                    i = next(position, None)
+                if i is None:
+                    break
+                kind, url = queries[i]
+                request_start = time.perf_counter()
+                connection.request('GET', url)
+                response = connection.getresponse()
+                response.read()
+                local.append((kind, time.perf_counter() - request_start))
+                assert response.status in (200, 304), f'{url}: {response.status}'
+                if response.will_close:
+                    connection.close()
+            with lock:
+                timings.extend(local)
+
+        threads = [threading.Thread(target=send) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        rss = [rss_kib(pid) for pid in worker_pids(process.pid) or [process.pid]]
+        return report(target, timings, elapsed, rss)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--target', choices=['client', *SERVERS], default='client')
+    arg_parser.add_argument('--requests', type=int, default=2000)
+    arg_parser.add_argument('--workers', type=int, default=2, help='server workers')
+    arg_parser.add_argument('--concurrency', type=int, default=8, help='concurrent connections to the server')
+    group = arg_parser.add_mutually_exclusive_group()
+    group.add_argument('--save', action='store_true', help='save the results as the new baselines')
+    group.add_argument('--check', action='store_true', help='exit with an error on regressions')
+    args = arg_parser.parse_args()
+
+    if args.target == 'client':
+        results = run_client(args.requests)
+    else:
+        results = run_server(args.target, args.requests, args.workers, args.concurrency)
+
+    if args.save:
+        save_baselines(f'{SUITE} {args.target}', results)
+    elif args.check and not check_baselines(f'{SUITE} {args.target}', results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
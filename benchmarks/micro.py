@@ -0,0 +1,85 @@
+"""
+Microbenchmarks of the building blocks of the mawaqit endpoints.
+
+Usage: python benchmarks/micro.py [--filter next] [--save | --check]
+
+The dataset doesn't cover the current date, queries are made on a day in the middle of it.
+"""
+import argparse
+from datetime import datetime, time, timedelta
+
+from common import autorange, check_baselines, save_baselines, time_calls
+
+from flask_restx import marshal
+
+from salat_dz import apiv1, apiv2
+from salat_dz.bundle import encode_bundle
+from salat_dz.store import get_store
+from salat_dz.translation import translate
+from salat_dz.utils import DZ, Time, get_wilaya, read_wilayas
+
+SUITE = 'micro'
+
+
+def benchmarks():
+    store = get_store()
+    day = store.dates[len(store.dates) // 2].astype(datetime)
+    now = DZ.localize(datetime.combine(day, time(12, 30)))
+    all_wilayas = store.filter_wilayas(None)
+    wilayas = read_wilayas()
+    query = dict(from_=None, to=None, days=None, n_days=None, n_weeks=None, wilayas=None, salawat=None)
+
+    v1_rows, _ = apiv1.mawaqit_lists.list_mawaqit(**{**query, 'from_': day, 'to': day}, limit=100)
+    time_field = Time()
+    day_positions = store.filter_days(from_=day, to=day)
+    json_rows = apiv1.mawaqit_lists.json_rows(store, 'ar')
+    two_days = store.filter_days(from_=day, to=day + timedelta(days=1))
+    batch = [(all_wilayas, two_days, None), (all_wilayas[:2], two_days, [0, 4])]
+
+    return {
+        'list_mawaqit v1 day all wilayas': lambda: apiv1.mawaqit_lists.list_mawaqit(**{**query, 'from_': day, 'to': day}, limit=100),
+        'list_mawaqit v2 30 days one wilaya': lambda: apiv2.mawaqit_lists.list_mawaqit(**{**query, 'from_': day, 'n_days': timedelta(days=30), 'wilayas': ['16']}, limit=100, language='en'),
+        'list_mawaqit v2 week 5 wilayas': lambda: apiv2.mawaqit_lists.list_mawaqit(**{**query, 'from_': day, 'n_weeks': timedelta(weeks=1), 'wilayas': ['16', '31', '25', 'Adrar', 'سطيف']}, limit=100, language='en'),
+        'list_mawaqit v1 salawat filter': lambda: apiv1.mawaqit_lists.list_mawaqit(**{**query, 'from_': day, 'to': day, 'salawat': ['الفجر', 'المغرب']}, limit=100),
+        'next_salawat all wilayas': lambda: store.next_salawat(all_wilayas, now, n=1),
+        'next_salawat one wilaya': lambda: store.next_salawat(all_wilayas[:1], now, n=1),
+        'nexts all wilayas': lambda: store.next_salawat(all_wilayas, now, n=None),
+        'translate': lambda: translate('الفجر', 'ar', 'en'),
+        'get_wilaya (linear scan)': lambda: get_wilaya('وهران', wilayas),
+        'aliases.resolve exact': lambda: store.aliases.resolve('Oran'),
+        'aliases.resolve fuzzy': lambda: store.aliases.resolve('Tlemsen'),
+        'locator.locate': lambda: store.locator.locate(36.7, 3.1),
+        'Time.format': lambda: time_field.format('05:12'),
+        'marshal 68 rows v1': lambda: marshal(v1_rows, apiv1.mawaqit, skip_none=True),
+        'json_rows 68 rows v1': lambda: json_rows.grid(all_wilayas, day_positions),
+        'json_rows groups 2 queries 140 rows v2': lambda: apiv2.mawaqit_lists.json_rows(store, 'en').groups(batch),
+        'encode_bundle one wilaya season': lambda: encode_bundle(store, 15, '20-21'),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--filter', default='', help='only run the benchmarks containing this text')
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    group = arg_parser.add_mutually_exclusive_group()
+    group.add_argument('--save', action='store_true', help='save the results as the new baselines')
+    group.add_argument('--check', action='store_true', help='exit with an error on regressions')
+    args = arg_parser.parse_args()
+
+    results = {}
+    selected = {name: function for name, function in benchmarks().items() if args.filter in name}
+    for name, function in selected.items():
+        seconds = time_calls(function, autorange(function), args.repeat)
+        results[name] = {'us': seconds * 1e6, 'ops': 1 / seconds}
+
+    for name, measures in results.items():
+        print(f'{name:40s} {measures["us"]:12.2f}us {measures["ops"]:12.0f}/s')
+
+    if args.save:
+        save_baselines(SUITE, results)
+    elif args.check and not check_baselines(SUITE, results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
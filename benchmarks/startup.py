@@ -0,0 +1,76 @@
+"""
+Compare the time it takes a worker to load the mawaqit from the CSVs and from the compiled snapshot.
+
+Usage: python benchmarks/startup.py [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from salat_dz.config import settings
+from salat_dz.snapshot import build_snapshot, load_snapshot
+from salat_dz.store import read_store
+
+
+# loads the store in a fresh interpreter, like a newly booted gunicorn worker
+COLD_START = '''
+import time
+start = time.perf_counter()
+from salat_dz.{module} import {function}
+store = {function}({arg!r})
+store.minutes.sum()
+print(time.perf_counter() - start)
+'''
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        store = function()
+        # touch the data so the memory-mapped pages are really read
+        store.minutes.sum()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def cold_timed(module, function, arg, repeat):
+    code = COLD_START.format(module=module, function=function, arg=arg)
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+        timings.append(float(output.split()[-1]))
+    return timings
+
+
+def report(name, timings):
+    print(f'{name:28s} min={min(timings) * 1000:9.2f}ms median={statistics.median(timings) * 1000:9.2f}ms')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    directory = settings.mawaqit_for_wilayas_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'mawaqit.snapshot')
+        build_snapshot(directory, path)
+        print(f'Snapshot size: {os.path.getsize(path) / 1024:.1f}KiB')
+
+        report('csv (warm)', timed(lambda: read_store(directory), args.repeat))
+        report('snapshot (warm)', timed(lambda: load_snapshot(path), args.repeat))
+        report('csv (cold process)', cold_timed('store', 'read_store', directory, args.repeat))
+        report('snapshot (cold process)', cold_timed('snapshot', 'load_snapshot', path, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
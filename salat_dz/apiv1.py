@@ -1,31 +1,30 @@
-from datetime import datetime, time
-from functools import partial
+from operator import attrgetter
 import logging
 
 from flask import Blueprint, abort
 from flask_restx import Api, Resource
-from flask_restx.fields import Date, String
+from flask_restx.fields import String
 from pytz import timezone
 from webargs import fields, validate
 from webargs.flaskparser import parser, use_kwargs
 
 from .config import settings
+from .metrics import mark, stage
+from .pagination import FORMATS, validate_cursor
+from .queries import MawaqitQueries, locate_wilayas
+from .store import get_store, validate_wilaya
+from .translation import LAYOUTS
 from .utils import (
     Time,
     argmap_to_swagger_params,
-    create_mawaqits,
-    read_mawaqit_for_wilayas,
-    translate,
-    next_salawat,
 )
 
 logger = logging.getLogger(__name__)
 
 DZ = timezone('Africa/Algiers')
 
-mawaqit_for_wilayas = read_mawaqit_for_wilayas(settings.mawaqit_for_wilayas_dir)
-mawaqits = create_mawaqits(mawaqit_for_wilayas, settings.column_names.wilaya)
-wilayas_values = list(mawaqit_for_wilayas.keys())
+# the dataset is loaded with the app, not by its first request
+get_store()
 salawat_values = settings.salawat_names + ['next', 'nexts']
 
 
@@ -40,38 +39,21 @@ api = Api(
 
 ns = api.namespace('mawaqit', description='Provides Mawaqit')
 
-mawaqit = api.model('Mawaqit', {
-    settings.column_names.date: Date(),
-    settings.column_names.wilaya: String(),
-    settings.salawat.fajr: Time(),
-    settings.salawat.chorok: Time(),
-    settings.salawat.dhohr: Time(),
-    settings.salawat.asr: Time(),
-    settings.salawat.maghrib: Time(),
-    settings.salawat.icha: Time(),
-})
-
-mawaqit_en = api.model('MawaqitEn', {
-    settings.column_names_en.date: Date(),
-    settings.column_names_en.wilaya: String(),
-    settings.salawat_en.fajr: Time(),
-    settings.salawat_en.chorok: Time(),
-    settings.salawat_en.dhohr: Time(),
-    settings.salawat_en.asr: Time(),
-    settings.salawat_en.maghrib: Time(),
-    settings.salawat_en.icha: Time(),
-})
+mawaqit = api.model('Mawaqit', LAYOUTS['ar'].model_fields(String(), Time))
+
+mawaqit_en = api.model('MawaqitEn', LAYOUTS['en'].model_fields(String(), Time))
 
 # TODO: add validation to say: day and (from and to) are mutually execlusive
 """
 Time filtering: 
 * If no time filter is speified, mawaqait of the current date will be returned
 * You can filter time in various ways:
-    - Interval: use `from` and `to` parameters
+    - Interval: use `from` and `to` parameters, both are inclusive, `from` alone returns all the following days
     - Specific days: use `days` parameter
     - Number of days starting from a date (today by default): `n_days`
     - Number of weeks starting from a date (today by default): `n_weeks`
         If both `n_days` and `n_weeks` are specified, the duration will be added
+        If `to` is specified, it takes precedence over `n_days` and `n_weeks`
 """
 args = {
     'from_': fields.Date(data_key='from', metadata={'description': 'Where to start'}, missing=None),
@@ -79,9 +61,13 @@ args = {
     'days': fields.DelimitedList(fields.Date(), missing=None),
     'n_days': fields.TimeDelta(precision='days', missing=None),
     'n_weeks': fields.TimeDelta(precision='weeks', missing=None),
-    'wilayas': fields.DelimitedList(fields.Str(validate=validate.OneOf(wilayas_values)), missing=None),
+    'wilayas': fields.DelimitedList(fields.Str(validate=validate_wilaya), missing=None),
     'salawat': fields.DelimitedList(fields.Str(validate=validate.OneOf(salawat_values)), missing=None),
-    # TODO: Add latitude and longitude
+    'limit': fields.Int(validate=validate.Range(min=1, max=settings.pagination.max_limit), metadata={'description': 'Maximum number of rows per page'}, missing=None),
+    'cursor': fields.Str(validate=validate_cursor, metadata={'description': 'Where to start, as given by the X-Next-Cursor header of the previous page'}, missing=None),
+    'format_': fields.Str(data_key='format', validate=validate.OneOf(FORMATS), metadata={'description': 'json (paginated), ndjson or csv (streamed)'}, missing='json'),
+    'lat': fields.Float(validate=validate.Range(min=-90, max=90), metadata={'description': 'Latitude, adds the closest wilaya to the wilayas filter'}, missing=None),
+    'lon': fields.Float(validate=validate.Range(min=-180, max=180), metadata={'description': 'Longitude, adds the closest wilaya to the wilayas filter'}, missing=None),
     # TODO: add english salawat names
 }
 # TODO: add the query parameters to the swagger ui, see: 
@@ -102,58 +88,11 @@ def handle_request_parsing_error(err, req, schema, *, error_status_code, error_h
     abort(400, err.messages)
 
 
-def list_mawaqit(from_, to, days, n_days, n_weeks, wilayas, salawat, language='ar'):
-    '''List mawaqits'''
-    print(f'Calling with {locals()}')
-    query = mawaqits
-
-    today = datetime.now(tz=DZ).date()
-    # from_, to, page, limit = parse_common_args(request)
-    if not from_:
-        from_ = today
-
-    # TODO: Move it! Move it! to postprocess
-    if not to:
-        if n_days or n_weeks:
-            dt_from = datetime.combine(from_, time())
-            dt_to = dt_from + n_weeks + n_days
-            to = dt_to.date
-        else:
-            to = today
-
-    # Time Filtering
-    if days:
-        query = query[query[settings.column_names.date].isin(days)]
-    elif from_ == to == today:
-        query = query[query[settings.column_names.date] == today]
-    elif from_:
-        query = query[from_ <= query[settings.column_names.date]]
-    elif to:
-        query = query[query[settings.column_names.date] <= to]
-
-    # Filter wilayas
-    if wilayas:
-        query = query[query[settings.column_names.wilaya].isin(wilayas)]
-
-    if salawat:
-        if salawat == ['next'] or salawat == ['nexts']:
-            mawaqit_dict = {
-                key: value for key, value in query.iloc[0].to_dict().items()
-                    if key in settings.salawat_names
-            }
-            n = 1 if salawat == ['next'] else None # None means get all next mawaqit
-            salawat = next_salawat(mawaqit_dict, n=n)
-        columns = salawat + [settings.column_names.date, settings.column_names.wilaya]
-        query = query[columns]
-
-    # TODO: paginate result
-    query = query.head()
-
-    # Translate the result
-    translate_ = partial(translate, to=language)
-    query = query.rename(columns=translate_)
-
-    return query.to_dict('records')
+MODELS = {'ar': mawaqit, 'en': mawaqit_en}
+
+
+# the api v1 shows wilayas by the names found in the ministry PDFs, `store.names`
+mawaqit_lists = MawaqitQueries('v1', MODELS, attrgetter('names'))
 
 
 @ns.route(f'/')
@@ -161,9 +100,12 @@ class MawaqitList(Resource):
     '''Shows a list of all mawaqits'''
     @use_kwargs(args, location='query')
     @ns.doc('list_mawaqits', params=argmap_to_swagger_params(args))
-    @ns.marshal_list_with(mawaqit, skip_none=True)
-    def get(self, from_, to, days, n_days, n_weeks, wilayas, salawat):
-        return list_mawaqit(
+    @ns.response(200, 'Success', [mawaqit])
+    def get(self, from_, to, days, n_days, n_weeks, wilayas, salawat, limit, cursor, format_, lat, lon):
+        mark('args')
+        with stage('locate'):
+            wilayas = locate_wilayas(wilayas, lat, lon)
+        return mawaqit_lists.respond_mawaqit(
             from_=from_,
             to=to,
             days=days,
@@ -171,6 +113,9 @@ class MawaqitList(Resource):
             n_weeks=n_weeks,
             wilayas=wilayas,
             salawat=salawat,
+            limit=limit,
+            cursor=cursor,
+            format_=format_,
             language='ar',
         )
 
@@ -180,9 +125,12 @@ class MawaqitListEn(Resource):
     '''Shows a list of all mawaqits in english'''
     @use_kwargs(args, location='query')
     @ns.doc('list_mawaqits', params=argmap_to_swagger_params(args))
-    @ns.marshal_list_with(mawaqit_en, skip_none=True)
-    def get(self, from_, to, days, n_days, n_weeks, wilayas, salawat):
-        return list_mawaqit(
+    @ns.response(200, 'Success', [mawaqit_en])
+    def get(self, from_, to, days, n_days, n_weeks, wilayas, salawat, limit, cursor, format_, lat, lon):
+        mark('args')
+        with stage('locate'):
+            wilayas = locate_wilayas(wilayas, lat, lon)
+        return mawaqit_lists.respond_mawaqit(
             from_=from_,
             to=to,
             days=days,
@@ -190,5 +138,8 @@ class MawaqitListEn(Resource):
             n_weeks=n_weeks,
             wilayas=wilayas,
             salawat=salawat,
+            limit=limit,
+            cursor=cursor,
+            format_=format_,
             language='en',
         )
@@ -1,39 +1,44 @@
-from datetime import date, datetime, time
-from functools import partial
+from datetime import date, datetime, time, timedelta
 import logging
+from operator import attrgetter
+import os
 
-from flask import Blueprint, Flask, abort
-from flask_restx import Api, Resource
-from flask_restx.fields import Date, String, Nested
-import pandas as pd
+from flask import Blueprint, Flask, Response, abort, request, send_file
+from flask_restx import Api, Resource, marshal
+from flask_restx.fields import String, Nested
+from marshmallow import Schema
 from pytz import timezone
 from webargs import fields, validate
 from webargs.flaskparser import parser, use_kwargs
 
+from . import events, rendering
+from .bundle import MIMETYPE as BUNDLE_MIMETYPE, get_bundle
+from .asgi import EVENT_STREAM
+from .cache import get_response_cache, query_key
 from .config import settings
+from .export import EXPORT_FORMATS, MIMETYPES as EXPORT_MIMETYPES, build_export, parquet_available
+from .ical import MIMETYPE as ICAL_MIMETYPE, SALAT_NAMES, render_feed, vevents
+from .metrics import mark, stage
+from .pagination import FORMATS, validate_cursor
+from .partitions import get_partitions
+from .queries import MawaqitQueries, locate_wilayas, query_days
+from .reload import on_reload
+from .store import get_store, validate_wilaya
+from .translation import LAYOUTS, SALAT_POSITIONS
 from .utils import (
     Time,
     argmap_to_swagger_params,
-    create_mawaqits_v2,
-    get_wilaya,
-    read_mawaqit_for_wilayas_v2,
-    read_wilayas,
-    get_wilayas_values,
-    translate,
-    next_salawat,
+    date_window,
 )
 
 logger = logging.getLogger(__name__)
 
 DZ = timezone('Africa/Algiers')
 
-mawaqit_for_wilayas = read_mawaqit_for_wilayas_v2(settings.mawaqit_for_wilayas_dir)
-mawaqits = create_mawaqits_v2(mawaqit_for_wilayas, settings.column_names.wilaya)
-# TODO: first check the names scrapped from wikipedia with thoese extracted from the pdfs
-# wilayas_values = read_wilayas_values(settings.wilayas_file)
-# wilayas_values = list(mawaqit_for_wilayas.keys())
-wilayas = read_wilayas()
-wilayas_values = get_wilayas_values(wilayas)
+# the dataset is loaded with the app, not by its first request
+get_store()
+response_cache = get_response_cache()
+partitions = get_partitions()
 salawat_values = settings.salawat_names + ['next', 'nexts']
 
 
@@ -49,31 +54,26 @@ api = Api(
 
 ns = api.namespace('mawaqit', description='Provides Mawaqit')
 
-mawaqit = api.model('Mawaqit', {
-    settings.column_names_en.date: Date(),
-    settings.column_names_en.wilaya: Nested(api.model('Wilaya', {
+mawaqit = api.model('Mawaqit', LAYOUTS['en'].model_fields(
+    Nested(api.model('Wilaya', {
         'code': String(),
         'arabic_name': String(),
         'english_name': String(),
     })),
-    settings.salawat_en.fajr: Time(),
-    settings.salawat_en.chorok: Time(),
-    settings.salawat_en.dhohr: Time(),
-    settings.salawat_en.asr: Time(),
-    settings.salawat_en.maghrib: Time(),
-    settings.salawat_en.icha: Time(),
-})
+    Time,
+))
 
 # TODO: add validation to say: day and (from and to) are mutually execlusive
 """
 Time filtering: 
 * If no time filter is speified, mawaqait of the current date will be returned
 * You can filter time in various ways:
-    - Interval: use `from` and `to` parameters
+    - Interval: use `from` and `to` parameters, both are inclusive, `from` alone returns all the following days
     - Specific days: use `days` parameter
     - Number of days starting from a date (today by default): `n_days`
     - Number of weeks starting from a date (today by default): `n_weeks`
         If both `n_days` and `n_weeks` are specified, the duration will be added
+        If `to` is specified, it takes precedence over `n_days` and `n_weeks`
 """
 args = {
     'from_': fields.Date(data_key='from', metadata={'description': 'Where to start'}, missing=None),
@@ -81,9 +81,13 @@ args = {
     'days': fields.DelimitedList(fields.Date(), missing=None),
     'n_days': fields.TimeDelta(precision='days', missing=None),
     'n_weeks': fields.TimeDelta(precision='weeks', missing=None),
-    'wilayas': fields.DelimitedList(fields.Str(validate=validate.OneOf(wilayas_values)), missing=None),
+    'wilayas': fields.DelimitedList(fields.Str(validate=validate_wilaya), missing=None),
     'salawat': fields.DelimitedList(fields.Str(validate=validate.OneOf(salawat_values)), missing=None),
-    # TODO: Add latitude and longitude
+    'limit': fields.Int(validate=validate.Range(min=1, max=settings.pagination.max_limit), metadata={'description': 'Maximum number of rows per page'}, missing=None),
+    'cursor': fields.Str(validate=validate_cursor, metadata={'description': 'Where to start, as given by the X-Next-Cursor header of the previous page'}, missing=None),
+    'format_': fields.Str(data_key='format', validate=validate.OneOf(FORMATS), metadata={'description': 'json (paginated), ndjson or csv (streamed)'}, missing='json'),
+    'lat': fields.Float(validate=validate.Range(min=-90, max=90), metadata={'description': 'Latitude, adds the closest wilaya to the wilayas filter'}, missing=None),
+    'lon': fields.Float(validate=validate.Range(min=-180, max=180), metadata={'description': 'Longitude, adds the closest wilaya to the wilayas filter'}, missing=None),
     # TODO: add english salawat names
 }
 # TODO: add the query parameters to the swagger ui, see: 
@@ -104,62 +108,8 @@ def handle_request_parsing_error(err, req, schema, *, error_status_code, error_h
     abort(400, err.messages)
 
 
-def list_mawaqit(from_, to, days, n_days, n_weeks, wilayas, salawat, language='ar'):
-    '''List mawaqits'''
-    print(f'Calling with {locals()}')
-    query = mawaqits
-
-    today = datetime.now(tz=DZ).date()
-    # from_, to, page, limit = parse_common_args(request)
-    if not from_:
-        from_ = today
-
-    # TODO: Move it! Move it! to postprocess
-    if not to:
-        if n_days or n_weeks:
-            dt_from = datetime.combine(from_, time())
-            dt_to = dt_from + n_weeks + n_days
-            to = dt_to.date
-        else:
-            to = today
-
-    # Time Filtering
-    if days:
-        query = query[query[settings.column_names.date].isin(days)]
-    elif from_ == to == today:
-        query = query[query[settings.column_names.date] == today]
-    elif from_:
-        query = query[from_ <= query[settings.column_names.date]]
-    elif to:
-        query = query[query[settings.column_names.date] <= to]
-
-    # Filter wilayas
-    if wilayas:
-        queries = []
-        for code_or_name in wilayas:
-            wilaya = get_wilaya(code_or_name)
-            queries.append(query[query[settings.column_names.wilaya] == wilaya])
-        query = pd.concat(queries)
-
-    if salawat:
-        if salawat == ['next'] or salawat == ['nexts']:
-            mawaqit_dict = {
-                key: value for key, value in query.iloc[0].to_dict().items()
-                    if key in settings.salawat_names
-            }
-            n = 1 if salawat == ['next'] else None # None means get all next mawaqit
-            salawat = next_salawat(mawaqit_dict, n=n)
-        columns = salawat + [settings.column_names.date, settings.column_names.wilaya]
-        query = query[columns]
-
-    # TODO: paginate result
-    query = query.head()
-
-    # Translate the result
-    translate_ = partial(translate, to=language)
-    query = query.rename(columns=translate_)
-
-    return query.to_dict('records')
+# the api v2 shows wilayas as objects with code, arabic_name and english_name, `store.wilayas`
+mawaqit_lists = MawaqitQueries('v2', dict.fromkeys(LAYOUTS, mawaqit), attrgetter('wilayas'))
 
 
 @ns.route(f'/')
@@ -167,9 +117,12 @@ class MawaqitList(Resource):
     '''Shows a list of all mawaqits'''
     @use_kwargs(args, location='query')
     @ns.doc('list_mawaqits', params=argmap_to_swagger_params(args))
-    @ns.marshal_list_with(mawaqit, skip_none=True)
-    def get(self, from_, to, days, n_days, n_weeks, wilayas, salawat):
-        return list_mawaqit(
+    @ns.response(200, 'Success', [mawaqit])
+    def get(self, from_, to, days, n_days, n_weeks, wilayas, salawat, limit, cursor, format_, lat, lon):
+        mark('args')
+        with stage('locate'):
+            wilayas = locate_wilayas(wilayas, lat, lon)
+        return mawaqit_lists.respond_mawaqit(
             from_=from_,
             to=to,
             days=days,
@@ -177,5 +130,249 @@ class MawaqitList(Resource):
             n_weeks=n_weeks,
             wilayas=wilayas,
             salawat=salawat,
+            limit=limit,
+            cursor=cursor,
+            format_=format_,
             language='en',
         )
+
+
+class BatchQuery(Schema):
+    '''A query of a batch, the filters of `GET /api/v2/mawaqit/` with JSON lists'''
+    from_ = fields.Date(data_key='from', missing=None)
+    to = fields.Date(missing=None)
+    days = fields.List(fields.Date(), missing=None)
+    n_days = fields.TimeDelta(precision='days', missing=None)
+    n_weeks = fields.TimeDelta(precision='weeks', missing=None)
+    wilayas = fields.List(fields.Str(validate=validate_wilaya), missing=None)
+    # arabic or english names, the rows are in english whatever the names used
+    salawat = fields.List(fields.Str(validate=validate.OneOf(list(SALAT_NAMES))), missing=None)
+
+
+batch_args = {
+    'queries': fields.List(
+        fields.Nested(BatchQuery),
+        required=True,
+        validate=validate.Length(min=1, max=settings.batch.max_queries),
+        metadata={'description': 'Queries of wilayas, days and salawat, like the query parameters of the list'},
+    ),
+}
+
+
+def batch_positions(store, queries, today):
+    '''(wilaya, day, salat) positions of every query of a batch'''
+    positions = []
+    for query in queries:
+        wilaya_positions = store.filter_wilayas(query['wilayas'])
+        if query['days']:
+            day_positions = store.filter_days(days=query['days'])
+        else:
+            from_, to = date_window(query['from_'], query['to'], query['n_days'], query['n_weeks'], today)
+            day_positions = store.filter_days(from_=from_, to=to)
+        salat_positions = None
+        if query['salawat']:
+            salat_positions = sorted({SALAT_NAMES[salat] for salat in query['salawat']})
+        positions.append((wilaya_positions, day_positions, salat_positions))
+    return positions
+
+
+@ns.route('/batch')
+class MawaqitBatch(Resource):
+    '''Mawaqits of several queries at once'''
+    @use_kwargs(batch_args, location='json')
+    @ns.doc('batch_mawaqits')
+    @ns.response(200, 'Success, the list of the mawaqits of every query')
+    def post(self, queries):
+        mark('args')
+        today = datetime.now(tz=DZ).date()
+        # one store for all the queries, the seasons of all their days
+        bounds = [query_days(query['from_'], query['to'], query['days'], query['n_days'], query['n_weeks'], today) for query in queries]
+        last_days = [last for _, last in bounds]
+        batch_store = partitions.for_days(min(first for first, _ in bounds), None if None in last_days else max(last_days))
+
+        with stage('filter'):
+            positions = batch_positions(batch_store, queries, today)
+        n_rows = sum(len(wilaya_positions) * len(day_positions) for wilaya_positions, day_positions, _ in positions)
+        if n_rows > settings.batch.max_rows:
+            abort(400, f'The queries select {n_rows} rows, more than {settings.batch.max_rows}')
+
+        if rendering.enabled():
+            with stage('records'):
+                text = mawaqit_lists.json_rows(batch_store, 'en').groups(positions)
+            return Response(text, mimetype=rendering.MIMETYPE)
+
+        layout = LAYOUTS['en']
+        with stage('marshal'):
+            return [
+                marshal(
+                    list(batch_store.iter_records(*query_positions, layout=layout, wilaya_value=batch_store.wilayas.__getitem__)),
+                    mawaqit,
+                    skip_none=True,
+                )
+                for query_positions in positions
+            ]
+
+
+def next_salat(wilaya_position, after):
+    '''Time and JSON row of the salat of the wilaya following the timestamp `after`, the events of `announcer`'''
+    now = datetime.fromtimestamp(after, tz=DZ)
+    store = partitions.for_days(now.date(), now.date() + timedelta(days=1))
+    cells = store.next_salawat([wilaya_position], now)
+    if not len(cells[0]):
+        return None
+    _, (day,), (salat,) = cells
+    at = datetime.combine(store.dates[day].item(), time()) + timedelta(minutes=int(store.minutes[wilaya_position, day, salat]))
+    return DZ.localize(at).timestamp(), mawaqit_lists.json_rows(store, 'en').cells(*cells).rstrip('\n')
+
+
+announcer = events.Announcer(next_salat, settings.events.heartbeat)
+
+# what was derived from the previous dataset goes with it
+on_reload(vevents.cache_clear)
+on_reload(partitions.clear)
+on_reload(response_cache.clear)
+on_reload(announcer.refresh)
+on_reload(get_bundle.cache_clear)
+# and what was derived from an evicted season, the caches keyed by store would keep it in memory
+partitions.on_evict(vevents.cache_clear)
+partitions.on_evict(get_bundle.cache_clear)
+
+stream_args = {
+    'wilayas': fields.DelimitedList(fields.Str(validate=validate_wilaya), metadata={'description': 'All the wilayas by default'}, missing=None),
+}
+
+
+@ns.route('/stream')
+class MawaqitStream(Resource):
+    '''Server-sent events of the next salat of the wilayas, pushed when each salat arrives'''
+    @use_kwargs(stream_args, location='query')
+    @ns.doc('stream_mawaqits', params=argmap_to_swagger_params(stream_args))
+    @ns.produces([events.MIMETYPE])
+    def get(self, wilayas):
+        mark('args')
+        subscription = announcer.subscription(get_store().filter_wilayas(wilayas).tolist())
+        if EVENT_STREAM in request.environ:
+            # the ASGI bridge streams the events from its event loop, without holding a thread
+            request.environ[EVENT_STREAM] = subscription
+            # an iterator, the response must not get a Content-Length
+            body = iter(())
+        else:
+            body = subscription.iter_events(settings.events.wsgi_max_seconds)
+        return Response(body, mimetype=events.MIMETYPE, headers=events.HEADERS)
+
+
+ical_args = {
+    'salawat': fields.DelimitedList(fields.Str(validate=validate.OneOf(list(SALAT_NAMES))), metadata={'description': 'Salawat of the feed, all by default'}, missing=None),
+    'alarms': fields.DelimitedList(fields.Int(validate=validate.Range(min=0, max=24 * 60)), metadata={'description': 'Alarms, in minutes before each salat'}, missing=None),
+    'year': fields.Int(metadata={'description': 'Only the days of this year'}, missing=None),
+    'language': fields.Str(validate=validate.OneOf(settings.languages), missing='en'),
+}
+
+
+@ns.route('/<string:wilaya>.ics')
+@ns.param('wilaya', 'Code, arabic or english name of the wilaya')
+class MawaqitCalendar(Resource):
+    '''iCalendar feed of the mawaqits of a wilaya'''
+    @use_kwargs(ical_args, location='query')
+    @ns.doc('mawaqits_calendar', params=argmap_to_swagger_params(ical_args))
+    @ns.produces([ICAL_MIMETYPE])
+    def get(self, wilaya, salawat, alarms, year, language):
+        mark('args')
+        # the feed of a year may span two seasons, the current season by default
+        feed_store = get_store() if year is None else partitions.for_days(date(year, 1, 1), date(year, 12, 31))
+        wilaya_position = feed_store.aliases.resolve(wilaya)
+        if wilaya_position is None:
+            abort(404, f'Unknown wilaya {wilaya}')
+
+        salat_positions = sorted({SALAT_NAMES[salat] for salat in salawat} if salawat else range(len(SALAT_POSITIONS)))
+        alarms = sorted(set(alarms or ()))
+
+        def render():
+            with stage('render'):
+                return render_feed(feed_store, wilaya_position, salat_positions, alarms, year, language), None
+
+        key = query_key(
+            f'v2/ics/{feed_store.version}',
+            wilaya=wilaya_position,
+            salawat=salat_positions,
+            alarms=alarms,
+            year=year,
+            language=language,
+        )
+        return response_cache.respond(
+            key=key,
+            render=render,
+            expires_at=lambda now: now + timedelta(seconds=settings.ical.max_age),
+            mimetype=ICAL_MIMETYPE,
+        )
+
+
+bundle_args = {
+    'season': fields.Str(metadata={'description': 'Season, e.g. 20-21, the current one by default'}, missing=None),
+}
+
+
+@ns.route('/<string:wilaya>/bundle')
+@ns.param('wilaya', 'Code, arabic or english name of the wilaya')
+class MawaqitBundle(Resource):
+    '''Mawaqits of a wilaya for a whole season, delta encoded for the clients answering locally'''
+    @use_kwargs(bundle_args, location='query')
+    @ns.doc('mawaqits_bundle', params=argmap_to_swagger_params(bundle_args))
+    @ns.produces([BUNDLE_MIMETYPE])
+    def get(self, wilaya, season):
+        mark('args')
+        season = season or settings.season
+        if season != settings.season and season not in [known.name for known in partitions.seasons]:
+            abort(404, f'Unknown season {season}')
+        season_store = partitions.load((season,))
+        wilaya_position = season_store.aliases.resolve(wilaya)
+        if wilaya_position is None:
+            abort(404, f'Unknown wilaya {wilaya}')
+
+        with stage('render'):
+            bundle = get_bundle(season_store, wilaya_position, season)
+        # compressed once, sent as is to the clients accepting gzip
+        gzipped = request.accept_encodings['gzip'] > 0
+        response = Response(bundle.gzipped if gzipped else bundle.body, mimetype=BUNDLE_MIMETYPE)
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        response.set_etag(f'{bundle.etag}-gzip' if gzipped else bundle.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = settings.bundle.max_age
+        return response.make_conditional(request)
+
+
+export_ns = api.namespace('export', description='Provides the whole dataset')
+
+export_args = {
+    'format_': fields.Str(data_key='format', validate=validate.OneOf(EXPORT_FORMATS), metadata={'description': 'csv or parquet'}, missing='csv'),
+    'wilaya': fields.Str(validate=validate_wilaya, metadata={'description': 'Export only this wilaya'}, missing=None),
+    'year': fields.Int(metadata={'description': 'Export only the days of this year'}, missing=None),
+}
+
+
+@export_ns.route('')
+class Export(Resource):
+    '''Exports the whole dataset'''
+    @use_kwargs(export_args, location='query')
+    @export_ns.doc('export_mawaqits', params=argmap_to_swagger_params(export_args))
+    def get(self, format_, wilaya, year):
+        mark('args')
+        if format_ == 'parquet' and not parquet_available():
+            abort(501, 'The parquet export is not available on this server')
+
+        # all the seasons by default
+        export_store = partitions.for_days() if year is None else partitions.for_days(date(year, 1, 1), date(year, 12, 31))
+        wilaya_position = None if wilaya is None else export_store.aliases.resolve(wilaya)
+        path = build_export(export_store, format_, wilaya_position, year)
+        response = send_file(
+            os.path.abspath(path),
+            mimetype=EXPORT_MIMETYPES[format_],
+            as_attachment=True,
+            attachment_filename=os.path.basename(path),
+            conditional=True,
+        )
+        response.cache_control.public = True
+        response.cache_control.max_age = settings.export_max_age
+        return response
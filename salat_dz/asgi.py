@@ -0,0 +1,170 @@
+"""
+ASGI adapter of the Flask app, for many concurrent keep-alive clients.
+
+The connections are held by the asyncio event loop of the ASGI server (uvicorn), an idle connection
+costs a socket and a few objects instead of a worker. The Flask app itself is synchronous, every request
+runs in a bounded pool of `settings.asgi.threads` threads, the bound of the blocking work of a worker.
+
+A view can hand a long-lived response over to the event loop: when `EVENT_STREAM` is in the environ it may
+set it to an `events.Subscription`, the bridge then streams its events once the view returned.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import sys
+from tempfile import SpooledTemporaryFile
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# request bodies bigger than this are spooled to disk
+MAX_MEMORY_BODY = 64 * 1024
+
+# environ key of the event stream a view hands over to the event loop
+EVENT_STREAM = 'salat_dz.event_stream'
+
+
+def build_environ(scope: dict, body) -> dict:
+    """WSGI environ of an ASGI http scope"""
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        EVENT_STREAM: None,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH' or name == 'CONTENT_TYPE':
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class WsgiBridge:
+    """ASGI application running a WSGI application in a bounded thread pool"""
+
+    def __init__(self, wsgi_application: Callable, threads: int = 16):
+        self.wsgi_application = wsgi_application
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(f'Unsupported ASGI scope {scope["type"]}')
+
+    async def lifespan(self, receive: Callable, send: Callable):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                logger.info(f'Serving the WSGI app with {self.threads} threads')
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope: dict, receive: Callable, send: Callable):
+        with SpooledTemporaryFile(max_size=MAX_MEMORY_BODY) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+
+            loop = asyncio.get_running_loop()
+            environ = build_environ(scope, body)
+            subscription = await loop.run_in_executor(self.executor, self.run, environ, loop, send)
+        if subscription is not None:
+            await self.stream(subscription, receive, send)
+
+    async def stream(self, subscription, receive: Callable, send: Callable):
+        """Send the events of the subscription until the client disconnects"""
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        subscription.open(lambda chunk: loop.call_soon_threadsafe(events.put_nowait, chunk))
+        disconnected = asyncio.ensure_future(self.disconnected(receive))
+        try:
+            while True:
+                event = asyncio.ensure_future(events.get())
+                await asyncio.wait({event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    event.cancel()
+                    return
+                await send({'type': 'http.response.body', 'body': event.result(), 'more_body': True})
+        finally:
+            subscription.close()
+            disconnected.cancel()
+
+    @staticmethod
+    async def disconnected(receive: Callable):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    def run(self, environ: dict, loop: asyncio.AbstractEventLoop, send: Callable):
+        """
+        Run the WSGI application in a thread of the pool, its output is sent through the event loop.
+        Return the event stream the application handed over, the response is then left open.
+        """
+        status: List[Optional[Tuple[int, list]]] = [None]
+
+        def start_response(status_line: str, headers: list, exc_info=None):
+            if exc_info and status[0] is not None and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            code = int(status_line.split(' ', 1)[0])
+            status[0] = (code, [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers])
+
+        def send_sync(message: dict):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = False
+        result = self.wsgi_application(environ, start_response)
+        try:
+            # a buffered response is sent in one message, a streamed one chunk by chunk
+            chunks = result if not isinstance(result, (list, tuple)) else [b''.join(result)]
+            for chunk in chunks:
+                if not chunk and started:
+                    continue
+                if not started:
+                    code, headers = status[0]
+                    send_sync({'type': 'http.response.start', 'status': code, 'headers': headers})
+                    started = True
+                send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        if not started:
+            code, headers = status[0]
+            send_sync({'type': 'http.response.start', 'status': code, 'headers': headers})
+        subscription = environ[EVENT_STREAM]
+        if subscription is None:
+            send_sync({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        return subscription
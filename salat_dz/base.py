@@ -1,13 +1,13 @@
 import logging
-import warnings
 from flask import Blueprint, render_template, request, make_response
 from datetime import datetime, timedelta
 from webargs.flaskparser import parser
-from webargs import fields, validate
-from marshmallow import Schema, pre_load
+from webargs import fields
+from marshmallow import Schema
 
 
-from .apiv1 import wilayas_values
+from .asgi import EVENT_STREAM
+from .store import get_store, validate_wilaya
 
 
 blueprint = Blueprint('base', __name__)
@@ -16,25 +16,24 @@ logger = logging.getLogger(__name__)
 
 
 class WilayaArg(Schema):
-    wilaya = fields.Str(validate=validate.OneOf(wilayas_values))
-    @pre_load
-    def handle_multi_word_wilaya(self, in_data, **kwargs):
-        out_data = {**in_data}
-        warnings.warn('Hacking ..., check why multi word wilayas have two spaces')
-        out_data['wilaya'] = out_data['wilaya'].replace(' ', '  ')
-        return out_data
+    wilaya = fields.Str(validate=validate_wilaya)
 
 
 @blueprint.route('/')
 def index():
     saved_wilaya = request.cookies.get('wilaya')
-    return render_template('index.html', wilayas=wilayas_values, saved_wilaya=saved_wilaya)
+    # the page follows the next salat over an event stream when the ASGI bridge holds them, it counts down locally otherwise
+    event_streams = EVENT_STREAM in request.environ
+    return render_template('index.html', wilayas=get_store().names, saved_wilaya=saved_wilaya, event_streams=event_streams)
 
 
 @blueprint.route('/save')
 @parser.use_kwargs(WilayaArg, location="query")
 def save_wilaya(wilaya):
     logger.debug(f'Saving wilaya {wilaya}')
+    # save the name as shown in the wilayas list whatever the spelling used
+    store = get_store()
+    wilaya = store.names[store.aliases.resolve(wilaya)]
     response = make_response()
     experies = datetime.now() + timedelta(days=365)
     response.set_cookie('wilaya', wilaya, expires=experies)
@@ -0,0 +1,241 @@
+"""
+Incremental build of the dataset: CSVs, snapshot and exports.
+
+The manifest (`settings.build.manifest_file`) records the content hashes of the inputs of every region
+(pdf, tabula template and the settings used to read them), of the CSVs it produced, and of the inputs
+of the store (wilayas file and rename table). A build only extracts the regions whose inputs or outputs
+changed, only rewrites the CSVs whose content differs, and only rebuilds the snapshot and the exports
+when the dataset changed.
+
+`--check` extracts every region again and diffs the CSVs it would write against the existing ones, without
+writing anything, e.g. after a change of the reader.
+
+Usage: python -m salat_dz.build [--force | --check] [--workers N]
+"""
+import argparse
+import difflib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Iterable, List, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+# settings read by the reader, a change in any of them changes the CSVs
+READER_SETTINGS = ('regions', 'column_names', 'salawat_names')
+# settings read when loading the CSVs in the store
+STORE_SETTINGS = ('rename',)
+
+
+def hash_bytes(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path: str) -> Optional[str]:
+    """Content hash of a file, None when it doesn't exist"""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_settings(keys: Iterable[str]) -> str:
+    values = {key: settings.get(key) for key in keys}
+    return hash_bytes(json.dumps(values, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+
+
+def region_inputs(region: str) -> Dict[str, Optional[str]]:
+    return {
+        'pdf': hash_file(settings.pdf_paths[region]),
+        'template': hash_file(settings.tabula_templates[region]),
+        'settings': hash_settings(READER_SETTINGS),
+    }
+
+
+def csv_path(wilaya: str) -> str:
+    return os.path.join(settings.mawaqit_for_wilayas_dir, f'{wilaya}.csv')
+
+
+def read_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {'version': MANIFEST_VERSION, 'regions': {}}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        logger.warning(f'Manifest {path} has an unknown version, rebuilding everything')
+        return {'version': MANIFEST_VERSION, 'regions': {}}
+    return manifest
+
+
+def write_atomic(path: str, content: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        # mkstemp makes it readable by its owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def is_up_to_date(entry: Optional[dict], inputs: Dict[str, Optional[str]]) -> bool:
+    """Whether a region has the same inputs as in the manifest and its CSVs weren't touched since"""
+    if entry is None or entry['inputs'] != inputs:
+        return False
+    return all(hash_file(csv_path(wilaya)) == digest for wilaya, digest in entry['outputs'].items())
+
+
+def write_outputs(mawaqit_for_wilayas: dict, previous: Dict[str, str]) -> Dict[str, str]:
+    """Write the CSVs whose content changed, remove the ones the region doesn't produce anymore"""
+    # imported here, the reader needs tabula and java which are only needed when a region changed
+    from .reader import check_dates, mawaqit_to_csv
+
+    outputs = {}
+    for wilaya, mawaqit in mawaqit_for_wilayas.items():
+        check_dates(mawaqit.index)
+        content = mawaqit_to_csv(mawaqit).encode('utf-8')
+        outputs[wilaya] = hash_bytes(content)
+        path = csv_path(wilaya)
+        if hash_file(path) != outputs[wilaya]:
+            logger.info(f'Writing {path}')
+            write_atomic(path, content)
+
+    for wilaya in previous.keys() - outputs.keys():
+        path = csv_path(wilaya)
+        if os.path.exists(path):
+            logger.info(f'Removing {path}, it is not produced anymore')
+            os.remove(path)
+    return outputs
+
+
+def diff_outputs(mawaqit_for_wilayas: dict, context: int = 3) -> List[str]:
+    """Log the differences between the CSVs of the mawaqit and the existing ones, return the wilayas differing"""
+    from .reader import mawaqit_to_csv
+
+    differing = []
+    for wilaya, mawaqit in mawaqit_for_wilayas.items():
+        path = csv_path(wilaya)
+        expected = ''
+        if os.path.exists(path):
+            with open(path, encoding='utf-8', newline='') as f:
+                expected = f.read()
+        content = mawaqit_to_csv(mawaqit)
+        if content == expected:
+            continue
+        differing.append(wilaya)
+        diff = difflib.unified_diff(
+            expected.splitlines(), content.splitlines(), fromfile=path, tofile=f'{wilaya} (extracted)', n=context, lineterm='',
+        )
+        logger.error('\n'.join(diff))
+    return differing
+
+
+def check(workers: Optional[int] = None) -> List[str]:
+    """Extract every region and diff its CSVs against the existing ones, return the wilayas differing"""
+    from .reader import read_regions
+
+    differing = []
+    for region, mawaqit_for_wilayas in read_regions(settings.regions, workers).items():
+        region_differing = diff_outputs(mawaqit_for_wilayas)
+        logger.info(f'Region {region}: {len(mawaqit_for_wilayas) - len(region_differing)}/{len(mawaqit_for_wilayas)} CSVs identical')
+        differing.extend(region_differing)
+    return differing
+
+
+def build(force: bool = False, workers: Optional[int] = None, manifest_file: Optional[str] = None) -> dict:
+    """Bring the CSVs, the snapshot and the exports up to date with their inputs, return the manifest"""
+    manifest_file = manifest_file or settings.build.manifest_file
+    manifest = read_manifest(manifest_file)
+
+    inputs = {region: region_inputs(region) for region in settings.regions}
+    changed = [
+        region for region in settings.regions
+        if force or not is_up_to_date(manifest['regions'].get(region), inputs[region])
+    ]
+    for region in changed:
+        missing = [name for name, digest in inputs[region].items() if digest is None]
+        if missing:
+            raise FileNotFoundError(f'Missing {", ".join(missing)} of region {region}')
+
+    if changed:
+        from .reader import read_regions
+
+        logger.info(f'Extracting the regions {changed}')
+        os.makedirs(settings.mawaqit_for_wilayas_dir, exist_ok=True)
+        for region, mawaqit_for_wilayas in read_regions(changed, workers).items():
+            previous = manifest['regions'].get(region, {}).get('outputs', {})
+            outputs = write_outputs(mawaqit_for_wilayas, previous)
+            manifest['regions'][region] = {'inputs': inputs[region], 'outputs': outputs}
+    else:
+        logger.info('All the regions are up to date')
+
+    build_artifacts(manifest, force)
+    write_atomic(manifest_file, json.dumps(manifest, ensure_ascii=False, indent=4, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def build_artifacts(manifest: dict, force: bool = False):
+    """Rebuild the snapshot when the CSVs changed, and the exports of the dataset version they don't exist for"""
+    from .export import EXPORT_FORMATS, build_export, parquet_available
+    from .snapshot import SnapshotError, build_snapshot, is_stale, load_snapshot
+    from .validation import validate
+
+    store_inputs = {
+        'settings': hash_settings(STORE_SETTINGS),
+        'wilayas': hash_file(settings.wilayas_file),
+    }
+    store = None
+    if not force and manifest.get('store') == store_inputs and os.path.exists(settings.snapshot_file):
+        try:
+            if not is_stale(settings.snapshot_file, settings.mawaqit_for_wilayas_dir):
+                store = load_snapshot(settings.snapshot_file)
+        except SnapshotError as e:
+            logger.warning(f'Cannot load snapshot {settings.snapshot_file}: {e}')
+    if store is None:
+        logger.info(f'Building snapshot {settings.snapshot_file}')
+        # fails on an invalid dataset
+        store = build_snapshot()
+    else:
+        validate(store).raise_for_violations()
+
+    if manifest.get('dataset') != store.version:
+        logger.info(f'Dataset version {manifest.get("dataset")} -> {store.version}')
+    manifest['dataset'] = store.version
+    manifest['store'] = store_inputs
+
+    # exports are stored per dataset version, build_export is a no-op for the existing ones
+    for format_ in EXPORT_FORMATS:
+        if format_ == 'parquet' and not parquet_available():
+            continue
+        build_export(store, format_)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental build of the mawaqit dataset')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--force', action='store_true', help='rebuild everything, whatever the manifest says')
+    group.add_argument('--check', action='store_true', help='diff the extracted CSVs against the existing ones, write nothing')
+    parser.add_argument('--workers', type=int, default=settings.reader.workers, help='processes extracting the pdf pages')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.check:
+        differing = check(workers=args.workers)
+        if differing:
+            raise SystemExit(f'{len(differing)} CSVs differ: {", ".join(differing)}')
+        return
+    build(force=args.force, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
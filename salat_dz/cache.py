@@ -0,0 +1,189 @@
+"""
+Response cache of the mawaqit endpoints.
+
+The answer of a query only changes at midnight (Africa/Algiers), or at the next salat for `salawat=next`,
+so every entry expires exactly at that boundary. Responses carry a strong ETag and a `Cache-Control`
+max-age derived from the same boundary, so clients and proxies can revalidate with 304s.
+"""
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+import hashlib
+import json
+import logging
+import threading
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+
+import numpy as np
+from flask import Response, request
+
+from .config import settings
+from .pagination import next_page_headers
+from .utils import DZ
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(NamedTuple):
+    data: Any
+    etag: str
+    expires: float
+    # cursor of the next page, its links are built for every request
+    cursor: Optional[str]
+
+
+class MemoryBackend:
+    """Bounded LRU cache local to the worker"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str, now: float) -> Optional[CachedResponse]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CachedResponse):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisBackend:
+    """Cache shared by all the workers, needs the redis package"""
+
+    def __init__(self, url: str, prefix: str = 'salatdz:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError('The redis cache backend needs the redis package: pip install redis') from e
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key: str, now: float) -> Optional[CachedResponse]:
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        entry = CachedResponse(*json.loads(value))
+        return entry if entry.expires > now else None
+
+    def set(self, key: str, entry: CachedResponse):
+        self.client.set(self.prefix + key, json.dumps(entry), exat=int(entry.expires) + 1)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def create_backend():
+    if settings.cache.backend == 'memory':
+        return MemoryBackend(settings.cache.max_entries)
+    if settings.cache.backend == 'redis':
+        return RedisBackend(settings.cache.redis_url)
+    raise ValueError(f'Unknown cache backend {settings.cache.backend}')
+
+
+def etag_of(data: Any) -> str:
+    if isinstance(data, str):
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+    content = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_backend()
+        self.hits = 0
+        self.misses = 0
+
+    def respond(self, key: str, render: Callable[[], Tuple[Any, Optional[str]]], expires_at: Callable[[datetime], datetime],
+                mimetype: Optional[str] = None):
+        """
+        Return the cached response of `key`, `render` it when it's missing or expired.
+
+        `render` returns the (marshalled) data with the cursor of its next page and `expires_at` the time the data changes.
+        Only the data and the cursor are cached, the links to the next page are built for the url of every request.
+        Return a 304 when the client already has the same data.
+        Data rendered to text is sent as is with the given `mimetype`, other data is left to the api representation.
+        """
+        now = datetime.now(tz=DZ)
+        entry = self.backend.get(key, now.timestamp())
+        if entry is None:
+            self.misses += 1
+            data, cursor = render()
+            entry = CachedResponse(data, etag_of(data), expires_at(now).timestamp(), cursor)
+            self.backend.set(key, entry)
+        else:
+            self.hits += 1
+
+        max_age = max(0, int(entry.expires - now.timestamp()))
+        headers = {
+            **next_page_headers(entry.cursor),
+            'ETag': f'"{entry.etag}"',
+            'Cache-Control': f'public, max-age={max_age}',
+        }
+        if request.if_none_match.contains(entry.etag):
+            return Response(status=304, headers=headers)
+        if mimetype is not None:
+            return Response(entry.data, mimetype=mimetype, headers=headers)
+        return entry.data, 200, headers
+
+    def clear(self):
+        self.backend.clear()
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache, shared by the api versions"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+
+def query_key(prefix: str, **query) -> str:
+    """Normalized cache key of a query, the same query written differently gets the same key"""
+    normalized = []
+    for name, value in sorted(query.items()):
+        if value is None:
+            continue
+        if isinstance(value, timedelta):
+            value = value.days
+        elif isinstance(value, date):
+            value = value.isoformat()
+        elif isinstance(value, (list, tuple, np.ndarray)):
+            value = ','.join(v.isoformat() if isinstance(v, date) else str(v) for v in value)
+        normalized.append(f'{name}={value}')
+    return f'{prefix}?' + '&'.join(normalized)
+
+
+def next_midnight(now: datetime) -> datetime:
+    return DZ.localize(datetime.combine(now.date() + timedelta(days=1), time()))
+
+
+def next_boundary(store, wilaya_positions: np.ndarray, salawat: Optional[list], now: datetime) -> datetime:
+    """When the answer of a query changes: the next salat of the wilayas for next/nexts, midnight otherwise"""
+    boundary = next_midnight(now)
+    if salawat == ['next'] or salawat == ['nexts']:
+        wilayas, days, salat_positions = store.next_salawat(wilaya_positions, now, n=1)
+        if len(wilayas):
+            minutes = store.minutes[wilayas, days, salat_positions].astype('timedelta64[m]')
+            first = (store.dates[days] + minutes).min().astype(datetime)
+            boundary = min(boundary, DZ.localize(first))
+    return boundary
@@ -0,0 +1,162 @@
+"""
+Server-sent events of the salawat, pushed to the subscribers when they arrive.
+
+A worker has one timer thread and one heap of the next salat of every subscribed wilaya, whatever the
+number of subscribers: between two salawat it sleeps, the open streams only get a heartbeat comment.
+When a salat arrives its subscribers get a `salat` event followed by a `next` event with the following one.
+The data of the events is the JSON list of `/api/v2/mawaqit/?wilayas=<wilaya>&salawat=next`.
+"""
+from heapq import heappop, heappush
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MIMETYPE = 'text/event-stream'
+HEADERS = {
+    'Cache-Control': 'no-cache',
+    # nginx must not buffer the stream
+    'X-Accel-Buffering': 'no',
+}
+HEARTBEAT = b': heartbeat\n\n'
+
+# (time, JSON data) of the salat following a time, None when the dataset has no following salat
+NextSalat = Callable[[int, float], Optional[Tuple[float, str]]]
+
+
+def format_event(event: str, data: str) -> bytes:
+    return f'event: {event}\ndata: {data}\n\n'.encode('utf-8')
+
+
+class Subscription:
+    """Events of some wilayas, delivered to a callback from the timer thread once opened"""
+
+    def __init__(self, announcer: 'Announcer', wilayas: Iterable[int]):
+        self.announcer = announcer
+        self.wilayas = sorted(set(wilayas))
+        self.deliver: Optional[Callable[[bytes], None]] = None
+
+    def open(self, deliver: Callable[[bytes], None]):
+        """`deliver` is called with every event, it must not block"""
+        self.deliver = deliver
+        self.announcer.subscribe(self)
+
+    def close(self):
+        self.announcer.unsubscribe(self)
+
+    def iter_events(self, max_seconds: float) -> Iterator[bytes]:
+        """The events for `max_seconds`, blocking a thread, for the servers streaming from a thread"""
+        events: queue.Queue = queue.Queue()
+        deadline = time.monotonic() + max_seconds
+        self.open(events.put_nowait)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    yield events.get(timeout=remaining)
+                except queue.Empty:
+                    return
+        finally:
+            self.close()
+
+
+class Announcer:
+    """Timer heap of the next salat of the subscribed wilayas, shared by all the subscriptions"""
+
+    def __init__(self, next_salat: NextSalat, heartbeat: float = 15.0):
+        self.next_salat = next_salat
+        self.heartbeat = heartbeat
+        # (time, wilaya, data), entries of wilayas scheduled again or without subscribers are skipped
+        self.heap: List[Tuple[float, int, str]] = []
+        # wilaya -> its entry in the heap, None when it has no following salat
+        self.scheduled: Dict[int, Optional[Tuple[float, int, str]]] = {}
+        self.subscribers: Dict[int, Set[Subscription]] = {}
+        self.subscriptions: Set[Subscription] = set()
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+
+    def subscription(self, wilayas: Iterable[int]) -> Subscription:
+        return Subscription(self, wilayas)
+
+    def schedule(self, wilaya: int, after: float):
+        entry = self.next_salat(wilaya, after)
+        if entry is not None:
+            entry = (entry[0], wilaya, entry[1])
+            heappush(self.heap, entry)
+        self.scheduled[wilaya] = entry
+
+    def next_event(self, wilaya: int) -> bytes:
+        entry = self.scheduled[wilaya]
+        return format_event('next', '[]' if entry is None else entry[2])
+
+    def subscribe(self, subscription: Subscription):
+        with self.condition:
+            now = time.time()
+            for wilaya in subscription.wilayas:
+                if wilaya not in self.scheduled:
+                    self.schedule(wilaya, now)
+                self.subscribers.setdefault(wilaya, set()).add(subscription)
+                subscription.deliver(self.next_event(wilaya))
+            self.subscriptions.add(subscription)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='announcer', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.condition:
+            self.subscriptions.discard(subscription)
+            for wilaya in subscription.wilayas:
+                subscribers = self.subscribers.get(wilaya)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    # its heap entry is dropped when it comes up
+                    del self.subscribers[wilaya]
+                    del self.scheduled[wilaya]
+
+    def refresh(self):
+        """Schedule the subscribed wilayas again, e.g. with a new dataset, and send them their next salat"""
+        with self.condition:
+            now = time.time()
+            for wilaya, subscribers in self.subscribers.items():
+                self.schedule(wilaya, now)
+                event = self.next_event(wilaya)
+                for subscription in subscribers:
+                    subscription.deliver(event)
+            self.condition.notify()
+
+    def announce(self, now: float):
+        """Send the events of the salawat arrived by `now` and schedule the following ones"""
+        while self.heap and self.heap[0][0] <= now:
+            entry = heappop(self.heap)
+            at, wilaya, data = entry
+            if self.scheduled.get(wilaya) != entry:
+                continue
+            self.schedule(wilaya, at)
+            events = format_event('salat', data) + self.next_event(wilaya)
+            for subscription in self.subscribers[wilaya]:
+                subscription.deliver(events)
+
+    def run(self):
+        next_heartbeat = time.time() + self.heartbeat
+        with self.condition:
+            while True:
+                now = time.time()
+                try:
+                    self.announce(now)
+                except Exception:
+                    logger.exception('Cannot announce the salawat')
+                if now >= next_heartbeat:
+                    for subscription in self.subscriptions:
+                        subscription.deliver(HEARTBEAT)
+                    next_heartbeat = now + self.heartbeat
+                wake_up = min(self.heap[0][0], next_heartbeat) if self.heap else next_heartbeat
+                self.condition.wait(max(0.0, wake_up - now))
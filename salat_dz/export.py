@@ -0,0 +1,116 @@
+"""
+Bulk exports of the whole dataset in CSV or Parquet.
+
+Every export is built once per dataset version and kept on disk under `settings.export_dir`,
+repeated downloads only send the file. Prebuild the unfiltered exports with `python -m salat_dz.export`.
+"""
+from datetime import date
+import logging
+import os
+import tempfile
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from .config import settings
+from .store import MINUTE_STRINGS, MawaqitStore, get_store
+from .translation import LAYOUTS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ['csv', 'parquet']
+MIMETYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_frame(store: MawaqitStore, wilaya_positions: np.ndarray, day_positions: np.ndarray) -> 'pd.DataFrame':
+    """The mawaqit ordered by date then wilaya, with the columns of the api v2 csv stream"""
+    # imported here, the workers only need pandas when an export is first requested
+    import pandas as pd
+
+    layout = LAYOUTS['en']
+    n_wilayas, n_days = len(wilaya_positions), len(day_positions)
+    minutes = store.minutes[np.ix_(wilaya_positions, day_positions)].transpose(1, 0, 2).reshape(-1, store.minutes.shape[2])
+    times = np.array(MINUTE_STRINGS)[minutes]
+    wilayas = [store.wilayas[position] for position in wilaya_positions]
+
+    frame = pd.DataFrame({
+        layout.date: np.repeat(store.dates[day_positions].astype(str), n_wilayas),
+        **{
+            f'{layout.wilaya}.{key}': np.tile([wilaya[key] for wilaya in wilayas], n_days)
+            for key in ('code', 'arabic_name', 'english_name')
+        },
+    })
+    for position, name in enumerate(layout.salawat):
+        frame[name] = times[:, position]
+    return frame
+
+
+def export_path(version: str, format_: str, wilaya_code: Optional[str] = None, year: Optional[int] = None) -> str:
+    name = 'mawaqit'
+    if wilaya_code is not None:
+        name += f'-wilaya-{wilaya_code}'
+    if year is not None:
+        name += f'-{year}'
+    return os.path.join(settings.export_dir, version, f'{name}.{format_}')
+
+
+def build_export(store: MawaqitStore, format_: str, wilaya: Optional[int] = None, year: Optional[int] = None) -> str:
+    """Return the path of the export, build it if it doesn't exist yet for this dataset version"""
+    wilaya_code = None if wilaya is None else store.wilayas[wilaya]['code']
+    path = export_path(store.version, format_, wilaya_code, year)
+    if os.path.exists(path):
+        return path
+
+    wilaya_positions = store.filter_wilayas(None) if wilaya is None else np.array([wilaya])
+    if year is None:
+        day_positions = store.filter_days()
+    else:
+        day_positions = store.filter_days(from_=date(year, 1, 1), to=date(year, 12, 31))
+
+    logger.info(f'Building export {path}')
+    frame = export_frame(store, wilaya_positions, day_positions)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file then rename it, so no download sees a partial export,
+    # unique to this build: the first downloads of an export may build it concurrently in several threads
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    os.close(fd)
+    try:
+        if format_ == 'csv':
+            frame.to_csv(tmp_path, index=False)
+        else:
+            frame.to_parquet(tmp_path, index=False)
+        # mkstemp makes it readable by its owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    store = get_store()
+    for format_ in EXPORT_FORMATS:
+        if format_ == 'parquet' and not parquet_available():
+            logger.warning('Skipping the parquet export, pyarrow is not installed')
+            continue
+        build_export(store, format_)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Offline reverse geocoding: coordinates to the closest wilaya (or locality) of the store.
+
+The ministry publishes the mawaqit of the wilaya seats and of a few localities, so the best times
+for a position are the ones of the closest of these places. Their coordinates are bundled in
+`settings.locations_file` and indexed in a grid of `settings.geo.cell_size` degrees, a lookup only
+measures the distance to the places of the few cells around the position.
+"""
+import json
+import logging
+import math
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# kilometers per degree of latitude
+KM_PER_DEGREE = 111.2
+
+
+def read_locations(path: Optional[str] = None) -> List[dict]:
+    with open(path or settings.locations_file) as f:
+        return json.load(f)
+
+
+class GridIndex:
+    """Nearest neighbour lookup of points bucketed in a regular latitude/longitude grid"""
+
+    def __init__(self, points: List[Tuple[float, float, int]], cell_size: float = 1.0):
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, int], List[Tuple[float, float, int]]] = defaultdict(list)
+        for latitude, longitude, value in points:
+            self.cells[self.cell(latitude, longitude)].append((latitude, longitude, value))
+        self.cells = dict(self.cells)
+
+        rows = [row for row, _ in self.cells] or [0]
+        columns = [column for _, column in self.cells] or [0]
+        self.bounds = (min(rows), min(columns), max(rows), max(columns))
+        # a degree of longitude is shorter away from the equator, bound the rings with the shortest one
+        max_latitude = max((abs(latitude) for latitude, _, _ in points), default=0) + cell_size
+        self.min_scale = math.cos(math.radians(min(max_latitude, 89)))
+
+    def cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def ring(self, row: int, column: int, radius: int):
+        """The cells at `radius` cells (chebyshev distance) of a cell"""
+        if radius == 0:
+            yield row, column
+            return
+        for r in range(row - radius, row + radius + 1):
+            yield r, column - radius
+            yield r, column + radius
+        for c in range(column - radius + 1, column + radius):
+            yield row - radius, c
+            yield row + radius, c
+
+    @staticmethod
+    def distance(latitude: float, longitude: float, other_latitude: float, other_longitude: float) -> float:
+        """Equirectangular distance in kilometers, accurate enough at the scale of a country"""
+        x = (other_longitude - longitude) * math.cos(math.radians((latitude + other_latitude) / 2))
+        y = other_latitude - latitude
+        return math.hypot(x, y) * KM_PER_DEGREE
+
+    def nearest(self, latitude: float, longitude: float) -> Optional[Tuple[int, float]]:
+        """Return the (value, distance in km) of the closest point, None if the index is empty"""
+        row, column = self.cell(latitude, longitude)
+        min_row, min_column, max_row, max_column = self.bounds
+        max_radius = max(abs(row - min_row), abs(row - max_row), abs(column - min_column), abs(column - max_column))
+
+        best = None
+        for radius in range(max_radius + 1):
+            # the points of this ring and the next ones are at least radius - 1 cells away
+            if best is not None and best[1] <= (radius - 1) * self.cell_size * self.min_scale * KM_PER_DEGREE:
+                break
+            for key in self.ring(row, column, radius):
+                for point_latitude, point_longitude, value in self.cells.get(key, ()):
+                    distance = self.distance(latitude, longitude, point_latitude, point_longitude)
+                    if best is None or distance < best[1]:
+                        best = (value, distance)
+        return best
+
+
+class WilayaLocator:
+    """Finds the wilaya of the store closest to a position, positions outside `settings.geo.bounds` have none"""
+
+    def __init__(self, aliases, locations: List[dict], cell_size: float = 1.0, bounds: Optional[List[float]] = None):
+        points = []
+        for location in locations:
+            position = aliases.resolve(location['wilaya'])
+            if position is None:
+                logger.debug(f'Location of {location["wilaya"]} has no mawaqit, ignoring it')
+                continue
+            points.append((location['latitude'], location['longitude'], position))
+        self.index = GridIndex(points, cell_size)
+        # south, west, north, east
+        self.bounds = bounds
+
+    def contains(self, latitude: float, longitude: float) -> bool:
+        if self.bounds is None:
+            return True
+        south, west, north, east = self.bounds
+        return south <= latitude <= north and west <= longitude <= east
+
+    def locate(self, latitude: float, longitude: float) -> Optional[int]:
+        """Return the position of the closest wilaya, None if the coordinates are out of the country"""
+        if not self.contains(latitude, longitude):
+            return None
+        nearest = self.index.nearest(latitude, longitude)
+        return None if nearest is None else nearest[0]
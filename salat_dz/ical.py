@@ -0,0 +1,153 @@
+"""
+iCalendar feeds of the mawaqit of a wilaya.
+
+Calendar apps poll their subscriptions often, so the VEVENT blocks are rendered once per
+(wilaya, year, salat) and a feed is only the concatenation of the blocks of its salawat,
+with the same VALARM block inserted in every event when alarms are requested.
+"""
+from datetime import date
+from functools import lru_cache
+import logging
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from .store import MINUTE_STRINGS, MawaqitStore
+from .translation import LAYOUTS, SALAWAT_KEYS
+
+logger = logging.getLogger(__name__)
+
+MIMETYPE = 'text/calendar'
+PRODID = '-//Salat Dz//Mawaqit//EN'
+TZID = 'Africa/Algiers'
+# Algeria stays on CET all year long
+VTIMEZONE = (
+    'BEGIN:VTIMEZONE',
+    f'TZID:{TZID}',
+    'BEGIN:STANDARD',
+    'DTSTART:19810101T000000',
+    'TZOFFSETFROM:+0100',
+    'TZOFFSETTO:+0100',
+    'TZNAME:CET',
+    'END:STANDARD',
+    'END:VTIMEZONE',
+)
+# names of the salawat in every language, mapped to their position
+SALAT_NAMES = {name: position for layout in LAYOUTS.values() for position, name in enumerate(layout.salawat)}
+# lines longer than this are folded, in octets without the CRLF
+LINE_LENGTH = 75
+
+
+def escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def fold(line: str) -> str:
+    """Fold a content line to 75 octets, without splitting utf-8 characters"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= LINE_LENGTH:
+        return line + '\r\n'
+
+    parts = []
+    start, limit = 0, LINE_LENGTH
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # don't cut in the middle of a multibyte character
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode('utf-8'))
+        # continuation lines start with a space
+        start, limit = end, LINE_LENGTH - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def lines(*content: str) -> str:
+    return ''.join(fold(line) for line in content)
+
+
+def year_days(store: MawaqitStore, year: Optional[int]) -> np.ndarray:
+    if year is None:
+        return store.filter_days()
+    return store.filter_days(from_=date(year, 1, 1), to=date(year, 12, 31))
+
+
+def feed_years(store: MawaqitStore, year: Optional[int] = None) -> Tuple[int, ...]:
+    """The years of the dataset, only `year` when given"""
+    years = np.unique(store.dates.astype('datetime64[Y]').astype(int) + 1970)
+    if year is not None:
+        years = years[years == year]
+    return tuple(int(y) for y in years)
+
+
+@lru_cache(maxsize=4096)
+def vevents(store: MawaqitStore, wilaya: int, year: int, salat: int, language: str = 'en') -> Tuple[str, ...]:
+    """
+    The events of a salat of a wilaya in a year, without their END:VEVENT line so alarms can be inserted.
+    They are rendered once per store, the store is a part of the cache key.
+    """
+    layout = LAYOUTS[language]
+    infos = store.wilayas[wilaya]
+    location = escape(infos['arabic_name'] if language == 'ar' else infos['english_name'])
+    summary = escape(layout.salawat[salat])
+    key = SALAWAT_KEYS[salat]
+    # the events never change once published, stamp them with the first day of the dataset
+    stamp = f'{store.dates[0].astype(date):%Y%m%d}T000000Z'
+
+    day_positions = year_days(store, year)
+    days = np.datetime_as_string(store.dates[day_positions]).tolist()
+    minutes = store.minutes[wilaya, day_positions, salat].tolist()
+    return tuple(
+        lines(
+            'BEGIN:VEVENT',
+            f'UID:{day}-{key}-{infos["code"]}@salat-dz',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART;TZID={TZID}:{day.replace("-", "")}T{MINUTE_STRINGS[minute].replace(":", "")}00',
+            'DURATION:PT0M',
+            f'SUMMARY:{summary}',
+            f'LOCATION:{location}',
+            'TRANSP:TRANSPARENT',
+        )
+        for day, minute in zip(days, minutes)
+    )
+
+
+def valarms(summary: str, alarms: Iterable[int]) -> str:
+    """VALARM blocks triggered the given minutes before the salat"""
+    return ''.join(
+        lines(
+            'BEGIN:VALARM',
+            'ACTION:DISPLAY',
+            f'DESCRIPTION:{escape(summary)}',
+            f'TRIGGER:-PT{alarm}M',
+            'END:VALARM',
+        )
+        for alarm in alarms
+    )
+
+
+def render_feed(store: MawaqitStore, wilaya: int, salat_positions: Iterable[int], alarms: Iterable[int] = (),
+                year: Optional[int] = None, language: str = 'en') -> str:
+    """The calendar of the salawat of a wilaya, assembled from the cached events"""
+    layout = LAYOUTS[language]
+    infos = store.wilayas[wilaya]
+    name = infos['arabic_name'] if language == 'ar' else infos['english_name']
+    alarms = sorted(set(alarms))
+
+    parts = [lines(
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape(name)}',
+        f'X-WR-TIMEZONE:{TZID}',
+        *VTIMEZONE,
+    )]
+    for salat in salat_positions:
+        end = valarms(layout.salawat[salat], alarms) + lines('END:VEVENT')
+        for feed_year in feed_years(store, year):
+            events = vevents(store, wilaya, feed_year, salat, language)
+            if events:
+                parts.append(end.join(events) + end)
+    parts.append(lines('END:VCALENDAR'))
+    return ''.join(parts)
@@ -0,0 +1,236 @@
+"""
+Request timing and metrics, cheap enough to stay on in production.
+
+Code paths are split in stages with `stage('name')`, every request reports its stages in a `Server-Timing`
+header and they are aggregated, with the request latencies, in histograms exposed in the Prometheus text
+format at `/metrics`, along with the dataset load time and the response cache hit rates.
+
+The metrics are kept per worker process.
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from flask import Blueprint, Response, request
+
+logger = logging.getLogger(__name__)
+
+# seconds, from 100us to 2.5s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels, **extra) -> str:
+    labels = labels + tuple(extra.items())
+    if not labels:
+        return ''
+    values = ','.join(f'{name}="{str(value)}"' for name, value in labels)
+    return '{' + values + '}'
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float] = BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # labels -> (bucket counts, sum)
+        self.series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        position = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][position] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {labels: (list(counts), total[0]) for labels, (counts, total) in self.series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{format_labels(labels, le="+Inf")} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Callback:
+    """Gauge or counter read when the metrics are scraped"""
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], Iterable[Tuple[dict, float]]], type_: str = 'gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.type = type_
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        try:
+            samples = list(self.function())
+        except Exception as e:
+            logger.warning(f'Cannot collect {self.name}: {e}')
+            return []
+        for labels, value in samples:
+            lines.append(f'{self.name}{format_labels(tuple(sorted(labels.items())))} {value}')
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+# (start, stage timings) of the request being handled, a context variable is much cheaper than flask.g
+_request_timings: ContextVar = ContextVar('request_timings', default=None)
+
+REQUEST_SECONDS = register(Histogram('salatdz_request_seconds', 'Latency of the requests'))
+STAGE_SECONDS = register(Histogram('salatdz_stage_seconds', 'Time spent in each stage of the requests'))
+
+
+class stage:
+    """Context manager timing a stage of the current request, it's added to its Server-Timing header"""
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+
+
+def record(name: str, seconds: float):
+    """Add the time to the stage of the current request, observed once the request ends"""
+    current = _request_timings.get()
+    if current is None:
+        STAGE_SECONDS.observe(seconds, stage=name, endpoint='')
+    else:
+        timings = current[1]
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def mark(name: str):
+    """Record the time from the start of the request to now as a stage, e.g. routing and parsing the arguments"""
+    current = _request_timings.get()
+    if current is not None:
+        record(name, time.perf_counter() - current[0])
+
+
+def timed(name: str):
+    """Decorator timing a whole function as a stage"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    entries = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in timings.items()]
+    entries.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(entries)
+
+
+def start_timer():
+    _request_timings.set((time.perf_counter(), {}))
+
+
+def add_server_timing(response: Response) -> Response:
+    current = _request_timings.get()
+    if current is None:
+        return response
+    _request_timings.set(None)
+    start, timings = current
+    total = time.perf_counter() - start
+    endpoint = request.endpoint or ''
+    REQUEST_SECONDS.observe(total, endpoint=endpoint, status=response.status_code)
+    for name, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=name, endpoint=endpoint)
+    response.headers['Server-Timing'] = server_timing(timings, total)
+    return response
+
+
+def dataset_samples():
+    # imported here, the store is only loaded by the api blueprints
+    from .store import get_store
+
+    store = get_store()
+    yield {'version': store.version}, 1
+
+
+def load_samples():
+    from .store import get_store
+
+    yield {}, get_store().load_seconds
+
+
+def partition_samples():
+    from .partitions import get_partitions
+
+    yield {}, len(get_partitions().loaded)
+
+
+def subscriber_samples():
+    from .apiv2 import announcer
+
+    yield {}, len(announcer.subscriptions)
+
+
+def cache_samples():
+    from .cache import get_response_cache
+
+    response_cache = get_response_cache()
+    yield {'result': 'hit'}, response_cache.hits
+    yield {'result': 'miss'}, response_cache.misses
+
+
+register(Callback('salatdz_dataset_info', 'Version of the dataset being served', dataset_samples))
+register(Callback('salatdz_dataset_load_seconds', 'Time it took to load the dataset in this worker', load_samples))
+register(Callback('salatdz_partitions_loaded', 'Seasons loaded in this worker besides the default one', partition_samples))
+register(Callback('salatdz_event_subscribers', 'Open event streams of the next salawat in this worker', subscriber_samples))
+register(Callback('salatdz_response_cache_requests_total', 'Lookups of the response cache', cache_samples, type_='counter'))
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+blueprint = Blueprint('metrics', __name__)
+
+
+@blueprint.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Time every request of the app"""
+    app.before_request(start_timer)
+    app.after_request(add_server_timing)
+    return app
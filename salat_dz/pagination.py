@@ -0,0 +1,107 @@
+"""
+Cursor pagination and streamed output of the mawaqit lists.
+
+Rows are ordered by date then wilaya, a cursor is an opaque token of the (date, wilaya) of
+the first row of the next page, so a page stays valid whatever the rows before it.
+"""
+import base64
+import csv
+import io
+import json
+from datetime import date
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from flask import Response, request
+from flask_restx import marshal
+from marshmallow import ValidationError
+from werkzeug.urls import url_encode
+
+FORMATS = ['json', 'ndjson', 'csv']
+MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# rows written to the stream at once
+CHUNK_SIZE = 256
+
+
+def encode_cursor(day: date, wilaya: int) -> str:
+    token = f'{day.isoformat()}/{wilaya}'.encode('utf-8')
+    return base64.urlsafe_b64encode(token).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        day, wilaya = token.split('/')
+        return date.fromisoformat(day), int(wilaya)
+    except ValueError as e:
+        raise ValueError(f'Invalid cursor {cursor}') from e
+
+
+def validate_cursor(cursor: str):
+    """marshmallow validator"""
+    try:
+        decode_cursor(cursor)
+    except ValueError as e:
+        raise ValidationError(str(e))
+
+
+def next_page_headers(cursor: Optional[str]) -> dict:
+    """Headers pointing to the next page, empty on the last page"""
+    if cursor is None:
+        return {}
+
+    args = request.args.to_dict(flat=False)
+    args['cursor'] = [cursor]
+    return {
+        'X-Next-Cursor': cursor,
+        'Link': f'<{request.base_url}?{url_encode(args)}>; rel="next"',
+    }
+
+
+def flatten(row: dict, prefix: str = '') -> dict:
+    """Flatten the nested objects of a row, their fields are named parent.field"""
+    flat = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def chunked(rows: Iterable, size: int = CHUNK_SIZE) -> Iterator[List]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def generate_ndjson(rows: Iterable[dict], model) -> Iterator[str]:
+    for chunk in chunked(rows):
+        yield ''.join(json.dumps(marshal(row, model, skip_none=True)) + '\n' for row in chunk)
+
+
+def generate_csv(rows: Iterable[dict], model) -> Iterator[str]:
+    buffer = io.StringIO()
+    # the columns of the full model, missing salawat are left empty
+    columns = list(flatten(marshal({}, model)).keys())
+    writer = csv.DictWriter(buffer, columns)
+    writer.writeheader()
+    for chunk in chunked(rows):
+        writer.writerows(flatten(marshal(row, model, skip_none=True)) for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_rows(rows: Iterable[dict], model, format_: str) -> Response:
+    """Stream the rows one chunk at a time, the whole result is never built in memory"""
+    generate = generate_ndjson if format_ == 'ndjson' else generate_csv
+    return Response(generate(rows, model), mimetype=MIMETYPES[format_])
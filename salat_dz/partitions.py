@@ -0,0 +1,181 @@
+"""
+Seasons of the dataset, loaded on first access and evicted when unused.
+
+The mawaqit are partitioned by season (hijri year), every season has its CSVs and compiled snapshot
+in `settings.seasons_dir/<season>/`. A worker keeps the season it serves by default (`settings.season`)
+and the `settings.partitions.max_loaded` most recently used other ones, so serving past and future years
+doesn't grow the memory of every worker. Queries spanning several seasons get a store merging them.
+What is derived from a season store is dropped with it, see `on_evict`.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import date
+import logging
+import os
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import settings
+from .store import MawaqitStore, get_store, load_store
+from .validation import DatasetError
+
+logger = logging.getLogger(__name__)
+
+# layout of a season directory, see `mawaqit_for_wilayas_dir` and `snapshot_file` in the settings
+MAWAQIT_DIR = 'mawaqit'
+SNAPSHOT_FILE = 'mawaqit.snapshot'
+
+
+class Season(NamedTuple):
+    name: str
+    directory: str
+    snapshot_file: str
+    first_day: date
+    last_day: date
+
+
+def discover_seasons(seasons_dir: str) -> List[str]:
+    """Names of the seasons found in `seasons_dir`, in chronological order"""
+    if not os.path.isdir(seasons_dir):
+        return []
+    return sorted(name for name in os.listdir(seasons_dir) if os.path.isdir(os.path.join(seasons_dir, name, MAWAQIT_DIR)))
+
+
+def csv_days(directory: str) -> Tuple[date, date]:
+    """First and last days of the CSVs of a season, the first column of the first and last rows of one of them"""
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.csv'))
+    if not names:
+        raise DatasetError(f'No mawaqit found in {directory}')
+    with open(os.path.join(directory, names[0]), encoding='utf-8') as f:
+        rows = [line for line in f.read().splitlines()[1:] if line]
+    if not rows:
+        raise DatasetError(f'{os.path.join(directory, names[0])} has no mawaqit')
+    return date.fromisoformat(rows[0].split(',', 1)[0]), date.fromisoformat(rows[-1].split(',', 1)[0])
+
+
+def merge_stores(stores: Sequence[MawaqitStore]) -> MawaqitStore:
+    """Store of consecutive seasons, along their date axis"""
+    first = stores[0]
+    for store in stores[1:]:
+        if store.names != first.names:
+            raise DatasetError(f'Seasons {first.version} and {store.version} do not have the same wilayas')
+    dates = np.concatenate([store.dates for store in stores])
+    if np.any(np.diff(dates) <= np.timedelta64(0, 'D')):
+        raise DatasetError(f'Seasons {", ".join(store.version for store in stores)} overlap')
+    minutes = np.concatenate([store.minutes for store in stores], axis=1)
+    return MawaqitStore(first.names, first.wilayas, dates, minutes)
+
+
+class Partitions:
+
+    def __init__(self, seasons_dir: str, default: str, max_loaded: int = 2):
+        self.seasons_dir = seasons_dir
+        self.default = default
+        self.max_loaded = max_loaded
+        # season names -> store, least recently used first
+        self.loaded: OrderedDict = OrderedDict()
+        # season names -> the store being loaded, the concurrent requests of a cold season wait for one load
+        self.loading: Dict[Tuple[str, ...], Future] = {}
+        self.evict_callbacks: List[Callable[[], None]] = []
+        self.lock = threading.Lock()
+        self._seasons: Optional[List[Season]] = None
+
+    def paths(self, name: str) -> Tuple[str, str]:
+        if name == self.default:
+            return settings.mawaqit_for_wilayas_dir, settings.snapshot_file
+        return os.path.join(self.seasons_dir, name, MAWAQIT_DIR), os.path.join(self.seasons_dir, name, SNAPSHOT_FILE)
+
+    def on_evict(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Call `callback` once a season store is evicted, to drop what was derived from it"""
+        self.evict_callbacks.append(callback)
+        return callback
+
+    @property
+    def seasons(self) -> List[Season]:
+        """The seasons with the days they cover, in chronological order, found without loading them"""
+        if self._seasons is None:
+            seasons = []
+            for name in discover_seasons(self.seasons_dir):
+                directory, snapshot_file = self.paths(name)
+                seasons.append(Season(name, directory, snapshot_file, *csv_days(directory)))
+            self._seasons = sorted(seasons, key=lambda season: season.first_day)
+        return self._seasons
+
+    def load(self, names: Tuple[str, ...]) -> MawaqitStore:
+        """Store of the seasons, loaded (and merged) on first access"""
+        if names == (self.default,):
+            return get_store()
+
+        with self.lock:
+            store = self.loaded.get(names)
+            if store is not None:
+                self.loaded.move_to_end(names)
+                return store
+            loading = self.loading.get(names)
+            if loading is None:
+                loading = self.loading[names] = Future()
+                loader = True
+            else:
+                loader = False
+        if not loader:
+            return loading.result()
+
+        # loaded out of the lock, a slow season doesn't block the ones already loaded
+        try:
+            if len(names) == 1:
+                store = load_store(*self.paths(names[0]))
+            else:
+                store = merge_stores([self.load((name,)) for name in names])
+        except BaseException as e:
+            with self.lock:
+                del self.loading[names]
+            loading.set_exception(e)
+            raise
+        logger.info(f'Loaded season(s) {", ".join(names)}, dataset {store.version}')
+
+        evicted = []
+        with self.lock:
+            del self.loading[names]
+            self.loaded[names] = store
+            self.loaded.move_to_end(names)
+            while len(self.loaded) > self.max_loaded:
+                evicted.append(self.loaded.popitem(last=False)[0])
+        loading.set_result(store)
+        for names in evicted:
+            logger.info(f'Evicted season(s) {", ".join(names)}')
+        if evicted:
+            for callback in self.evict_callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception(f'Cannot invalidate {callback} after the eviction')
+        return store
+
+    def for_days(self, from_: Optional[date] = None, to: Optional[date] = None) -> MawaqitStore:
+        """
+        Store covering the days from `from_` to `to` (inclusive, None is unbounded): the season of these days,
+        a merge of the seasons when they span several, the default season when no season has them.
+        """
+        names = tuple(
+            season.name for season in self.seasons
+            if (to is None or season.first_day <= to) and (from_ is None or season.last_day >= from_)
+        )
+        return self.load(names or (self.default,))
+
+    def clear(self):
+        with self.lock:
+            self.loaded.clear()
+        self._seasons = None
+
+
+_partitions: Optional[Partitions] = None
+
+
+def get_partitions() -> Partitions:
+    """Process-wide seasons of the dataset"""
+    global _partitions
+    if _partitions is None:
+        _partitions = Partitions(settings.seasons_dir, settings.season, settings.partitions.max_loaded)
+    return _partitions
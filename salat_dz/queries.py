@@ -0,0 +1,169 @@
+"""
+Mawaqit lists of the api versions.
+
+The api versions answer the same queries, they only differ by how a wilaya is shown in the rows, e.g.
+its name found in the ministry PDFs (`store.names`) or an object with its code and names (`store.wilayas`),
+by their models and by the prefix of their cache keys.
+"""
+from datetime import date, datetime, timedelta
+from functools import lru_cache, partial
+from itertools import islice
+import logging
+from typing import Callable, Dict, Optional, Sequence
+
+from flask import abort
+from flask_restx import marshal
+
+from . import rendering
+from .cache import get_response_cache, next_boundary, query_key
+from .config import settings
+from .metrics import stage
+from .pagination import decode_cursor, encode_cursor, next_page_headers, stream_rows
+from .partitions import get_partitions
+from .reload import on_reload
+from .store import MawaqitStore, get_store
+from .translation import LAYOUTS, SALAT_POSITIONS
+from .utils import DZ, date_window
+
+logger = logging.getLogger(__name__)
+
+
+def query_days(from_, to, days, n_days, n_weeks, today: date):
+    """First and last requested days, the last one is None when unbounded"""
+    if days:
+        return min(days), max(days)
+    return date_window(from_, to, n_days, n_weeks, today)
+
+
+def locate_wilayas(wilayas, lat, lon):
+    """Add the wilaya closest to the coordinates to the wilayas filter"""
+    if lat is None and lon is None:
+        return wilayas
+    if lat is None or lon is None:
+        abort(400, 'lat and lon should be given together')
+
+    store = get_store()
+    position = store.locator.locate(lat, lon)
+    if position is None:
+        abort(404, f'No wilaya found at {lat}, {lon}')
+    return (wilayas or []) + [store.names[position]]
+
+
+class MawaqitQueries:
+    """The mawaqit lists of an api version, its wilayas shown as `wilaya_values(store)`"""
+
+    def __init__(self, prefix: str, models: Dict[str, dict], wilaya_values: Callable[[MawaqitStore], Sequence]):
+        self.prefix = prefix
+        self.models = models
+        self.wilaya_values = wilaya_values
+        self.response_cache = get_response_cache()
+        self.partitions = get_partitions()
+        self.json_rows = lru_cache(maxsize=4)(self.render_json_rows)
+        on_reload(self.json_rows.cache_clear)
+        self.partitions.on_evict(self.json_rows.cache_clear)
+
+    def render_json_rows(self, store: MawaqitStore, language: str) -> rendering.JsonRows:
+        """JSON fragments of the rows of the language, `json_rows` renders them on first use"""
+        return rendering.JsonRows(store, self.models[language], LAYOUTS[language], self.wilaya_values(store))
+
+    def query_store(self, from_, to, days, n_days, n_weeks, salawat) -> MawaqitStore:
+        """The season, or the merged seasons, having the requested days"""
+        today = datetime.now(tz=DZ).date()
+        if salawat == ['next'] or salawat == ['nexts']:
+            # after icha the next salawat are the ones of tomorrow, maybe in the next season
+            return self.partitions.for_days(today, today + timedelta(days=1))
+        return self.partitions.for_days(*query_days(from_, to, days, n_days, n_weeks, today))
+
+    def list_mawaqit(self, from_, to, days, n_days, n_weeks, wilayas, salawat, limit=None, cursor=None, language='ar',
+                     renderer: Optional[rendering.JsonRows] = None, store: Optional[MawaqitStore] = None):
+        """
+        List mawaqits, return the rows (all the following rows when limit is None) and the cursor of the next page.
+        The rows are rendered to a JSON list by the `renderer` fragments when given.
+        `store` is the season having the requested days, found from the query by default.
+        """
+        logger.debug(f'Calling with {locals()}')
+        if store is None:
+            store = self.query_store(from_, to, days, n_days, n_weeks, salawat)
+        wilaya_value = self.wilaya_values(store).__getitem__
+
+        # Filter wilayas
+        with stage('wilayas'):
+            wilaya_positions = store.filter_wilayas(wilayas)
+
+        if salawat == ['next'] or salawat == ['nexts']:
+            n = 1 if salawat == ['next'] else None # None means get all next mawaqit
+            with stage('filter'):
+                cells = store.next_salawat(wilaya_positions, datetime.now(tz=DZ), n=n)
+            with stage('records'):
+                if renderer is not None:
+                    return renderer.cells(*cells), None
+                return store.cells_records(*cells, layout=LAYOUTS[language], wilaya_value=wilaya_value), None
+
+        today = datetime.now(tz=DZ).date()
+
+        # Time Filtering
+        with stage('filter'):
+            if days:
+                day_positions = store.filter_days(days=days)
+            else:
+                from_, to = date_window(from_, to, n_days, n_weeks, today)
+                day_positions = store.filter_days(from_=from_, to=to)
+
+        salat_positions = None
+        if salawat:
+            salat_positions = [SALAT_POSITIONS[salat] for salat in salawat if salat in SALAT_POSITIONS]
+
+        offset = 0
+        if cursor:
+            offset = store.row_position(wilaya_positions, day_positions, *decode_cursor(cursor))
+
+        if renderer is not None:
+            with stage('records'):
+                next_row = None if limit is None else store.row_at(wilaya_positions, day_positions, offset + limit)
+                return renderer.grid(wilaya_positions, day_positions, salat_positions, offset, limit), next_row and encode_cursor(*next_row)
+
+        rows = store.iter_records(
+            wilaya_positions,
+            day_positions,
+            salat_positions,
+            layout=LAYOUTS[language],
+            wilaya_value=wilaya_value,
+            offset=offset,
+        )
+        if limit is None:
+            return rows, None
+
+        with stage('records'):
+            next_row = store.row_at(wilaya_positions, day_positions, offset + limit)
+            return list(islice(rows, limit)), next_row and encode_cursor(*next_row)
+
+    def respond_mawaqit(self, from_, to, days, n_days, n_weeks, wilayas, salawat, limit, cursor, format_, language='ar'):
+        """Stream the mawaqits, or list a page of them through the response cache"""
+        model = self.models[language]
+        query = dict(from_=from_, to=to, days=days, n_days=n_days, n_weeks=n_weeks, wilayas=wilayas, salawat=salawat, cursor=cursor)
+        store = self.query_store(from_, to, days, n_days, n_weeks, salawat)
+        if format_ != 'json':
+            rows, next_cursor = self.list_mawaqit(**query, limit=limit, language=language, store=store)
+            # a page of a streamed list, given a limit, points to the next one like the json pages
+            response = stream_rows(rows, model, format_)
+            response.headers.extend(next_page_headers(next_cursor))
+            return response
+
+        query['limit'] = limit or settings.pagination.default_limit
+
+        fast = rendering.enabled()
+
+        def render():
+            if fast:
+                return self.list_mawaqit(**query, language=language, renderer=self.json_rows(store, language), store=store)
+            rows, next_cursor = self.list_mawaqit(**query, language=language, store=store)
+            with stage('marshal'):
+                return marshal(rows, model, skip_none=True), next_cursor
+
+        wilaya_positions = store.filter_wilayas(wilayas)
+        return self.response_cache.respond(
+            key=query_key(f'{self.prefix}/{language}/{store.version}', **{**query, 'wilayas': None if wilayas is None else wilaya_positions}),
+            render=render,
+            expires_at=partial(next_boundary, store, wilaya_positions, salawat),
+            mimetype=rendering.MIMETYPE if fast else None,
+        )
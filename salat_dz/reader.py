@@ -1,33 +1,33 @@
 from collections import defaultdict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 import re
 import os
 import logging
-from datetime import date, time, datetime, timedelta
-from typing import Dict, Iterable, Tuple, TypeVar, Union
+from typing import Dict, Iterable, List, Optional, Tuple, TypeVar
 
+import numpy as np
 import tabula
+from tabula.template import load_template
 import pandas as pd
 
 from .config import settings
+from .utils import str_to_date
+from .validation import date_gaps
 
 T = TypeVar("T")
 
 logger = logging.getLogger('reader')
 
+# keys of `settings.regions`, one pdf per region
+REGIONS = ('djelfa', 'alger', 'adrar')
+
+DAY_MINUTES = 24 * 60
+
 def grouped(iterable: Iterable[T], n=2) -> Iterable[Tuple[T, ...]]:
     """s -> (s0,s1,s2,...sn-1), (sn,sn+1,sn+2,...s2n-1), ..."""
     return zip(*[iter(iterable)] * n)
 
 
-def str_to_date(s):
-    # in the djelfa.pdf there a typo in this day, see page number 10
-    if s == '2020-04-17':
-        s = '2021-04-17'
-    if s == '03-09-2020':
-        s = '2020-09-03'
-    return date.fromisoformat(s.replace('/', '-'))
-
-
 def preprocess_mawaqit(mawaqit: pd.DataFrame) -> pd.DataFrame:
     logger.debug('Preprocessing mawaqit')
     assert mawaqit.shape == (29, 8) or mawaqit.shape == (30, 8), f'Mawaqit DataFrame should be of shape (29, 8) or (30, 8) not {mawaqit.shape}\n{mawaqit}'
@@ -35,19 +35,20 @@ def preprocess_mawaqit(mawaqit: pd.DataFrame) -> pd.DataFrame:
     mawaqit = mawaqit.drop(settings.column_names.date, axis=1)
     mawaqit = mawaqit.drop(settings.column_names.qibla, axis=1)
     mawaqit = mawaqit.rename(columns={settings.column_names.zawal: settings.column_names.dhohr})
-    mawaqit = mawaqit.applymap(time.fromisoformat)
     mawaqit = mawaqit.reindex(settings.salawat_names, axis=1)
-    return mawaqit
+    return mawaqit.apply(times_to_minutes)
 
 
-def time_plus_timedelta(t: time, td: timedelta) -> timedelta:
-    dt = datetime.combine(date.today(), t)
-    dt = dt + td
-    return dt.time()
+def times_to_minutes(times: pd.Series) -> pd.Series:
+    """Convert a column of 'HH:MM[:SS]' strings to minutes since midnight"""
+    times = times.astype(str).str.strip()
+    return times.str.slice(0, 2).astype(int) * 60 + times.str.slice(3, 5).astype(int)
 
 
-def timedelta_from_minutes(minutes: Union[int, str]) -> timedelta:
-    return timedelta(minutes=int(minutes))
+def minutes_to_times(minutes: np.ndarray) -> np.ndarray:
+    """Format minutes since midnight as 'HH:MM:SS' strings"""
+    hours, minutes = np.divmod(minutes, 60)
+    return np.char.add(np.char.add(np.char.zfill(hours.astype(str), 2), ':'), np.char.add(np.char.zfill(minutes.astype(str), 2), ':00'))
 
 
 def preprocess_diffs(diffs: pd.DataFrame) -> pd.DataFrame:
@@ -56,7 +57,7 @@ def preprocess_diffs(diffs: pd.DataFrame) -> pd.DataFrame:
     salawat_names = diffs[diff_column].values.tolist()
     diffs = diffs.drop(diff_column, axis=1)
     diffs.index = salawat_names
-    diffs = diffs.applymap(timedelta_from_minutes)
+    diffs = diffs.applymap(int)
     diffs = diffs.reindex(settings.salawat_names, axis=0)
     return diffs
 
@@ -115,11 +116,17 @@ DIFFS_PREPROCESSORS = {
 
 
 def add_region_to_diffs(diffs: pd.DataFrame, region: str) -> pd.DataFrame:
-    diffs[region] = [timedelta()] * 6
+    diffs[region] = 0
     return diffs
 
 def construct_mawaqit_for_wilayas(tables: list, region: str) -> dict:
-    mawaqit_for_wilayas = {}
+    """
+    Apply the diffs of every wilaya of the region to the mawaqit of the region, in minutes since midnight.
+
+    Each (mawaqit, diffs) pair is one broadcast of the (day, salat) mawaqit with the (salat, wilaya) diffs
+    to a (wilaya, day, salat) block, every wilaya is assembled once from its blocks at the end.
+    """
+    blocks = defaultdict(list)
     for mawaqit, diffs in grouped(tables, 2):
         mawaqit = preprocess_mawaqit(mawaqit)
         diffs_preprocessor = DIFFS_PREPROCESSORS[region]
@@ -127,51 +134,97 @@ def construct_mawaqit_for_wilayas(tables: list, region: str) -> dict:
         for (from_, to), diffs in diffs_map.items():
             mawaqit_from_to = mawaqit.iloc[from_: to]
             diffs = add_region_to_diffs(diffs, region)
-            for wilaya, diff in diffs.iteritems():
-                logger.debug(f'Processing wilaya {wilaya:12s} from {mawaqit_from_to.index.min()} to {mawaqit_from_to.index.max()}')
-                mawaqit_wilaya = mawaqit_from_to.apply(lambda row: row.combine(diff, time_plus_timedelta), axis=1)
-                if wilaya in mawaqit_for_wilayas:
-                    mawaqit_for_wilayas[wilaya] = pd.concat((mawaqit_for_wilayas[wilaya], mawaqit_wilaya))
-                else:
-                    mawaqit_for_wilayas[wilaya] = mawaqit_wilaya
+            logger.debug(f'Processing wilayas {list(diffs.columns)} from {mawaqit_from_to.index.min()} to {mawaqit_from_to.index.max()}')
+            block = (mawaqit_from_to.to_numpy()[np.newaxis, :, :] + diffs.to_numpy().T[:, np.newaxis, :]) % DAY_MINUTES
+            for wilaya, minutes in zip(diffs.columns, block):
+                blocks[wilaya].append((mawaqit_from_to.index, minutes))
 
+    mawaqit_for_wilayas = {}
+    for wilaya, wilaya_blocks in blocks.items():
+        indexes, minutes = zip(*wilaya_blocks)
+        mawaqit_for_wilayas[wilaya] = pd.DataFrame(
+            np.concatenate(minutes),
+            index=indexes[0].append(list(indexes[1:])),
+            columns=settings.salawat_names,
+        )
     return mawaqit_for_wilayas
 
 
+def mawaqit_to_csv(mawaqit: pd.DataFrame) -> str:
+    """The CSV content of the mawaqit of a wilaya"""
+    times = pd.DataFrame(minutes_to_times(mawaqit.to_numpy()), index=mawaqit.index, columns=mawaqit.columns)
+    return times.to_csv()
 
 
 def export_mawaqit_for_wilayas(mawaqit_for_wilayas):
     for wilaya, mawaqit_for_wilaya in mawaqit_for_wilayas.items():
         path = os.path.join(settings.mawaqit_for_wilayas_dir, f'{wilaya}.csv')
-        mawaqit_for_wilaya.to_csv(path)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(mawaqit_to_csv(mawaqit_for_wilaya))
 
 def check_dates(dates):
-    # TODO: check len(dates) = 356 which means the data contains the whole year
-    for i in range(len(dates)-1):
-        oneday = timedelta(days=1)
-        td = dates[i+1] - dates[i]
-        if td != oneday :
-            logger.error(f'{dates[i]} and {dates[i+1]} are not consecutif ({td})')
-            
-
-def run(region, pdf, template):
+    """Log the days that are not followed by the next day, see the validation module for the whole dataset checks"""
+    for i in date_gaps(dates):
+        logger.error(f'{dates[i]} and {dates[i+1]} are not consecutif ({dates[i+1] - dates[i]})')
+
+
+def read_page(region: str, pdf: str, option: dict) -> Dict[str, pd.DataFrame]:
+    """Extract the tables of one page of a template and apply their diffs, runs in a worker process"""
+    logger.debug(f'Reading page {option["pages"]} of {pdf}')
+    tables = tabula.read_pdf(pdf, **dict({'stream': True}, **option))
+    assert len(tables) % 2 == 0, f'Page {option["pages"]} of {pdf} should contain mawaqit and diffs tables, found {len(tables)} tables'
+    return construct_mawaqit_for_wilayas(tables, region=region)
+
+
+def submit_region(executor: Executor, region: str, pdf: str, template: str) -> List[Future]:
+    """Submit the pages of a region, in the order of the template"""
     logger.debug(f'Start reading for region {region} from {pdf} with template {template}')
-    tables = tabula.read_pdf_with_template(pdf, template, stream=True)
-    mawaqit_for_wilayas = construct_mawaqit_for_wilayas(tables, region=region)
+    return [executor.submit(read_page, region, pdf, option) for option in load_template(template)]
+
+
+def merge_pages(pages: Iterable[Dict[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+    """Concatenate the pages of every wilaya once, in the order of the pages"""
+    frames = defaultdict(list)
+    for page in pages:
+        for wilaya, mawaqit in page.items():
+            frames[wilaya].append(mawaqit)
+    return {wilaya: pd.concat(mawaqit) for wilaya, mawaqit in frames.items()}
+
+
+def export_region(region: str, mawaqit_for_wilayas: Dict[str, pd.DataFrame]):
     for wilaya, mawaqit in mawaqit_for_wilayas.items():
         logger.debug(f'Checking dates for {wilaya}')
         check_dates(mawaqit.index)
-    logger.debug(f'Exporting wilayas {list(mawaqit_for_wilayas.keys())} to {settings.mawaqit_for_wilayas_dir}')
-
+    logger.debug(f'Exporting wilayas {list(mawaqit_for_wilayas.keys())} of {region} to {settings.mawaqit_for_wilayas_dir}')
     export_mawaqit_for_wilayas(mawaqit_for_wilayas)
+
+
+def read_regions(regions: Iterable[str], workers: Optional[int] = None) -> Dict[str, Dict[str, pd.DataFrame]]:
+    """
+    Read the regions (keys of `settings.regions`) with a process pool, all their pages run concurrently.
+    The pages are merged in the template order, so the result doesn't depend on which worker finishes first.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            region: submit_region(executor, settings.regions[region], settings.pdf_paths[region], settings.tabula_templates[region])
+            for region in regions
+        }
+        return {region: merge_pages(future.result() for future in pages) for region, pages in futures.items()}
+
+
+def run(region, pdf, template, workers: Optional[int] = None):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pages = submit_region(executor, region, pdf, template)
+        mawaqit_for_wilayas = merge_pages(future.result() for future in pages)
+    export_region(region, mawaqit_for_wilayas)
     logger.debug(f'Reading from {pdf} finished succesfully')
 
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
-    run(settings.regions.djelfa, settings.pdf_paths.djelfa, settings.tabula_templates.djelfa)
-    run(settings.regions.alger, settings.pdf_paths.alger, settings.tabula_templates.alger)
-    run(settings.regions.adrar, settings.pdf_paths.adrar, settings.tabula_templates.adrar)
+    for region, mawaqit_for_wilayas in read_regions(REGIONS, settings.reader.workers).items():
+        export_region(settings.regions[region], mawaqit_for_wilayas)
+        logger.debug(f'Reading from {settings.pdf_paths[region]} finished succesfully')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,110 @@
+"""
+Hot reload of the dataset, without restarting the workers.
+
+`reload_store` loads the dataset from disk again (validated like at startup), swaps it in and runs the
+`on_reload` callbacks invalidating what was derived from the previous one (rendered fragments, cached
+responses, seasons, scheduled events). Every request keeps the store it started with, whatever the
+reloads happening meanwhile, and reports its version in the `X-Dataset-Version` header.
+
+A worker reloads on SIGHUP (send it to the workers, e.g. `pkill -HUP -P <gunicorn master pid>`: the
+gunicorn master restarts its workers on SIGHUP) or on `POST /admin/reload` when `settings.admin.token` is set.
+"""
+import hmac
+import logging
+import signal
+import threading
+from typing import Callable, List
+
+from flask import Blueprint, Response, abort, jsonify, request
+
+from .config import settings
+from .store import MawaqitStore, get_store, load_store, pin_store, swap_store, unpin_store
+from .validation import DatasetError
+
+logger = logging.getLogger(__name__)
+
+VERSION_HEADER = 'X-Dataset-Version'
+
+CALLBACKS: List[Callable[[], None]] = []
+
+_reload_lock = threading.Lock()
+
+
+def on_reload(callback: Callable[[], None]) -> Callable[[], None]:
+    """Call `callback` once a new dataset is swapped in"""
+    CALLBACKS.append(callback)
+    return callback
+
+
+def reload_store() -> MawaqitStore:
+    """
+    Load the dataset from disk and serve it when its version changed.
+    Raise a DatasetError, and keep serving the current one, when it's invalid.
+    """
+    with _reload_lock:
+        current = get_store()
+        store = load_store()
+        if store.version == current.version:
+            logger.info(f'Dataset {current.version} is up to date')
+            return current
+
+        swap_store(store)
+        for callback in CALLBACKS:
+            try:
+                callback()
+            except Exception:
+                logger.exception(f'Cannot invalidate {callback} after the reload')
+        logger.info(f'Reloaded dataset {current.version} -> {store.version}')
+        return store
+
+
+def reload_in_background():
+    def run():
+        try:
+            reload_store()
+        except DatasetError as e:
+            logger.error(f'Cannot reload the dataset: {e}')
+        except Exception:
+            logger.exception('Cannot reload the dataset')
+
+    threading.Thread(target=run, name='reload', daemon=True).start()
+
+
+def install_signal_handler():
+    """Reload on SIGHUP, when the process can have signal handlers"""
+    if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_in_background())
+
+
+def add_version_header(response: Response) -> Response:
+    response.headers[VERSION_HEADER] = get_store().version
+    return response
+
+
+blueprint = Blueprint('admin', __name__, url_prefix='/admin')
+
+
+@blueprint.route('/reload', methods=['POST'])
+def reload():
+    token = settings.admin.token
+    if not token:
+        abort(404)
+    given = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(given.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+        abort(403)
+    previous = get_store().version
+    try:
+        store = reload_store()
+    except DatasetError as e:
+        return jsonify({'message': f'Invalid dataset, still serving {previous}: {e}'}), 409
+    return jsonify({'previous': previous, 'version': store.version})
+
+
+def init_app(app):
+    """Pin the store of every request and reload on SIGHUP"""
+    app.before_request(pin_store)
+    app.after_request(add_version_header)
+    app.teardown_request(unpin_store)
+    install_signal_handler()
+    return app
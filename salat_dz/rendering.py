@@ -0,0 +1,131 @@
+"""
+JSON rendering of the mawaqit lists without marshalling every row.
+
+The formatted JSON of every date, wilaya and (salat, time) pair is rendered once per model with the
+fields of the model itself, a response is then a numpy gather of these fragments joined in one call.
+The output is byte for byte the one of `marshal(rows, model, skip_none=True)` sent by flask-restx.
+"""
+import logging
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from flask import current_app
+from flask_restx.representations import dumps
+
+from .store import MINUTE_STRINGS, MawaqitStore
+from .translation import Layout
+
+logger = logging.getLogger(__name__)
+
+MIMETYPE = 'application/json'
+
+# separators of the json encoder flask-restx uses
+_probe = dumps({'a': 0, 'b': 0})
+KEY_SEPARATOR = _probe[len('{"a"'):_probe.index('0')]
+ITEM_SEPARATOR = _probe[_probe.index('0') + 1:_probe.index('"b"')]
+CLOSE = '}' + ITEM_SEPARATOR
+
+
+def enabled() -> bool:
+    """The fragments are rendered for the default encoder settings, pretty printed responses are marshalled"""
+    return not current_app.debug and not current_app.config.get('RESTX_JSON')
+
+
+def pair(key: str, value) -> str:
+    return f'{dumps(key)}{KEY_SEPARATOR}{dumps(value)}'
+
+
+class JsonRows:
+    """
+    Pre-rendered JSON fragments of the rows of a model:
+    `days[d]` opens a row with its date, `wilayas[w]` is the wilaya item and
+    `salawat[s, m]` is the item of the salat `s` at `m` minutes, preceded by a separator.
+    """
+
+    def __init__(self, store: MawaqitStore, model: dict, layout: Layout, wilaya_values: Sequence):
+        self.store = store
+        logger.debug(f'Rendering the JSON fragments of {model.name} for dataset {store.version}')
+        date_field, wilaya_field = model[layout.date], model[layout.wilaya]
+        self.days = np.array(['{' + pair(layout.date, date_field.format(day)) + ITEM_SEPARATOR for day in store.dates.tolist()], dtype=object)
+        self.wilayas = np.array([
+            pair(layout.wilaya, wilaya_field.output(layout.wilaya, {layout.wilaya: value}))
+            for value in wilaya_values
+        ], dtype=object)
+        # the salawat fields usually have the same settings, the times are formatted once per distinct field
+        times = {}
+        salawat = []
+        for name in layout.salawat:
+            field = model[name]
+            signature = (type(field), repr(sorted(vars(field).items())))
+            if signature not in times:
+                times[signature] = [dumps(field.format(time)) for time in MINUTE_STRINGS]
+            key = ITEM_SEPARATOR + dumps(name) + KEY_SEPARATOR
+            salawat.append([key + value for value in times[signature]])
+        self.salawat = np.array(salawat, dtype=object)
+
+    def grid(self, wilaya_positions: np.ndarray, day_positions: np.ndarray, salat_positions: Optional[Sequence[int]] = None,
+             offset: int = 0, limit: Optional[int] = None) -> str:
+        """The rows `offset` to `offset + limit` ordered by date then wilaya, like `MawaqitStore.iter_records`"""
+        n_wilayas = len(wilaya_positions)
+        total = n_wilayas * len(day_positions)
+        stop = total if limit is None else min(total, offset + limit)
+        day_indexes, wilaya_indexes = np.divmod(np.arange(min(offset, stop), stop), max(n_wilayas, 1))
+        wilayas, days = wilaya_positions[wilaya_indexes], day_positions[day_indexes]
+
+        # marshalling follows the order of the model, whatever the order of the filter
+        salat_positions = range(self.salawat.shape[0]) if salat_positions is None else sorted(set(salat_positions))
+        minutes = self.store.minutes[wilayas, days]
+        columns = [self.days[days], self.wilayas[wilayas]]
+        columns.extend(self.salawat[salat, minutes[:, salat]] for salat in salat_positions)
+        columns.append(np.full(len(days), CLOSE, dtype=object))
+        return dump(columns)
+
+    def cells(self, wilaya_positions: np.ndarray, day_positions: np.ndarray, salat_positions: np.ndarray) -> str:
+        """Rows of (wilaya, day, salat) cells, consecutive cells of the same wilaya and day share a row like `MawaqitStore.cells_records`"""
+        if not len(wilaya_positions):
+            return '[]\n'
+        starts = np.ones(len(wilaya_positions), dtype=bool)
+        starts[1:] = (np.diff(wilaya_positions) != 0) | (np.diff(day_positions) != 0)
+        ends = np.append(starts[1:], True)
+
+        minutes = self.store.minutes[wilaya_positions, day_positions, salat_positions]
+        heads = np.where(starts, self.days[day_positions] + self.wilayas[wilaya_positions], '')
+        tails = np.where(ends, CLOSE, '')
+        return dump([heads, self.salawat[salat_positions, minutes], tails])
+
+    def groups(self, queries: Sequence[Tuple[np.ndarray, np.ndarray, Optional[Sequence[int]]]]) -> str:
+        """
+        The rows of several `grid` queries (wilaya, day and salat positions) gathered at once,
+        rendered as the JSON list of the list of rows of every query.
+        """
+        n_salawat = self.salawat.shape[0]
+        counts = [len(wilaya_positions) * len(day_positions) for wilaya_positions, day_positions, _ in queries]
+        wilayas = np.concatenate([np.tile(wilaya_positions, len(day_positions)) for wilaya_positions, day_positions, _ in queries]).astype(np.intp)
+        days = np.concatenate([np.repeat(day_positions, len(wilaya_positions)) for wilaya_positions, day_positions, _ in queries]).astype(np.intp)
+        masks = np.ones((len(queries), n_salawat), dtype=bool)
+        for query, (_, _, salat_positions) in enumerate(queries):
+            if salat_positions is not None:
+                masks[query] = np.isin(np.arange(n_salawat), salat_positions)
+        masks = np.repeat(masks, counts, axis=0)
+
+        minutes = self.store.minutes[wilayas, days]
+        columns = [self.days[days], self.wilayas[wilayas]]
+        columns.extend(np.where(masks[:, salat], self.salawat[salat, minutes[:, salat]], '') for salat in range(n_salawat))
+        columns.append(np.full(len(days), CLOSE, dtype=object))
+        fragments = np.stack(columns, axis=1).ravel().tolist() if len(days) else []
+
+        # the rows of a query are consecutive, only the joins are done per query
+        lists = []
+        start = 0
+        for count in counts:
+            stop = start + count * len(columns)
+            body = ''.join(fragments[start:stop])
+            lists.append('[' + body[:-len(ITEM_SEPARATOR)] + ']' if body else '[]')
+            start = stop
+        return '[' + ITEM_SEPARATOR.join(lists) + ']\n'
+
+
+def dump(columns: Sequence[np.ndarray]) -> str:
+    """Join the fragment columns row by row into a JSON list, the last column closes the objects"""
+    body = ''.join(np.stack(columns, axis=1).ravel().tolist())
+    return '[' + body[:-len(ITEM_SEPARATOR)] + ']\n' if body else '[]\n'
@@ -0,0 +1,119 @@
+"""
+Compiled binary snapshot of the mawaqit store.
+
+Layout of a snapshot file:
+
+* `MAGIC` followed by the format version and the header length (little endian uint32)
+* a JSON header describing the wilayas and the arrays
+* the date axis (int64 days since epoch) and the minutes array (int16), aligned on `ALIGNMENT` bytes
+
+The arrays are memory-mapped when loading, so loading is near-instant and
+the pages are shared by all the workers through the OS page cache.
+"""
+import os
+import json
+import logging
+import struct
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from .config import settings
+from .store import MawaqitStore, read_store
+from .validation import validate
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SALATDZ\0'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+PREAMBLE = struct.Struct('<8sII')
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(store: MawaqitStore, path: str):
+    dates = np.ascontiguousarray(store.dates.astype('datetime64[D]').astype('<i8'))
+    minutes = np.ascontiguousarray(store.minutes.astype('<i2'))
+
+    header = {
+        'version': store.version,
+        'names': store.names,
+        'wilayas': store.wilayas,
+        'shape': list(minutes.shape),
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    dates_offset = _align(PREAMBLE.size + len(header_bytes))
+    minutes_offset = _align(dates_offset + dates.nbytes)
+
+    # write to a temporary file then rename it, so readers never see a partial snapshot,
+    # unique to this writer: several threads or workers may write the snapshot of a season at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            f.seek(dates_offset)
+            f.write(dates.tobytes())
+            f.seek(minutes_offset)
+            f.write(minutes.tobytes())
+        # mkstemp makes it readable by its owner only, the workers may run as another user
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logger.info(f'Snapshot {store.version} written to {path}')
+
+
+def load_snapshot(path: str) -> MawaqitStore:
+    with open(path, 'rb') as f:
+        preamble = f.read(PREAMBLE.size)
+        if len(preamble) != PREAMBLE.size:
+            raise SnapshotError(f'{path} is not a mawaqit snapshot')
+        magic, format_version, header_length = PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise SnapshotError(f'{path} is not a mawaqit snapshot')
+        if format_version != FORMAT_VERSION:
+            raise SnapshotError(f'{path} has format version {format_version}, expected {FORMAT_VERSION}')
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+    shape = tuple(header['shape'])
+    dates_offset = _align(PREAMBLE.size + header_length)
+    minutes_offset = _align(dates_offset + shape[1] * 8)
+    dates = np.memmap(path, dtype='<i8', mode='r', offset=dates_offset, shape=(shape[1],))
+    minutes = np.memmap(path, dtype='<i2', mode='r', offset=minutes_offset, shape=shape)
+
+    return MawaqitStore(header['names'], header['wilayas'], dates.view('datetime64[D]'), minutes, version=header['version'])
+
+
+def is_stale(path: str, directory: str) -> bool:
+    """Whether the sources of the snapshot changed after it was built"""
+    snapshot_mtime = os.path.getmtime(path)
+    sources = [settings.wilayas_file] + [os.path.join(directory, f) for f in os.listdir(directory)]
+    return any(os.path.getmtime(source) > snapshot_mtime for source in sources)
+
+
+def build_snapshot(directory: Optional[str] = None, path: Optional[str] = None) -> MawaqitStore:
+    directory = directory or settings.mawaqit_for_wilayas_dir
+    path = path or settings.snapshot_file
+    store = read_store(directory)
+    validate(store).raise_for_violations()
+    write_snapshot(store, path)
+    return store
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    build_snapshot()
+
+
+if __name__ == '__main__':
+    main()
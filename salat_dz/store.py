@@ -0,0 +1,330 @@
+from contextvars import ContextVar
+import os
+import json
+import hashlib
+import logging
+import time
+from datetime import date, datetime
+from pathlib import Path
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+from .geo import WilayaLocator, read_locations
+from .translation import LAYOUTS, Layout
+from .utils import get_wilaya, read_wilayas, str_to_date
+from .validation import validate
+from .wilayas import WilayaIndex
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+DAY_MINUTES = 24 * 60
+
+# 'HH:MM' representation of every minute of the day, indexed by minutes since midnight
+MINUTE_STRINGS = [f'{m // 60:02d}:{m % 60:02d}' for m in range(DAY_MINUTES)]
+
+
+def time_to_minutes(times: 'pd.Series') -> np.ndarray:
+    """Convert a column of 'HH:MM[:SS]' strings to minutes since midnight"""
+    hours = times.str.slice(0, 2).astype(np.int16)
+    minutes = times.str.slice(3, 5).astype(np.int16)
+    return (hours * 60 + minutes).to_numpy(dtype=np.int16)
+
+
+class MawaqitStore:
+    """
+    Columnar store of the mawaqit of all wilayas.
+
+    * `names`: wilaya names as found in the ministry PDFs (used by the api v1)
+    * `wilayas`: wilaya objects with code, arabic_name and english_name (used by the api v2)
+    * `dates`: sorted date axis shared by all wilayas, as datetime64[D]
+    * `minutes`: dense (wilaya, day, salat) array of minutes since midnight
+    """
+
+    def __init__(self, names: List[str], wilayas: List[dict], dates: np.ndarray, minutes: np.ndarray, version: Optional[str] = None):
+        assert minutes.shape == (len(names), len(dates), len(settings.salawat_names)), f'minutes should be of shape (wilaya, day, salat) not {minutes.shape}'
+        self.names = names
+        self.wilayas = wilayas
+        self.dates = dates
+        self.minutes = minutes
+        self._version = version
+        self._aliases = None
+        self._locator = None
+        # seconds it took to load the store, set by load_store
+        self.load_seconds = 0.0
+
+    @property
+    def version(self) -> str:
+        """Content hash of the store, used to tell datasets apart"""
+        if self._version is None:
+            digest = hashlib.sha1()
+            digest.update(json.dumps([self.names, self.wilayas], ensure_ascii=False).encode('utf-8'))
+            digest.update(np.ascontiguousarray(self.dates.astype('datetime64[D]').astype('<i8')).tobytes())
+            digest.update(np.ascontiguousarray(self.minutes.astype('<i2')).tobytes())
+            self._version = digest.hexdigest()[:12]
+        return self._version
+
+    @property
+    def aliases(self) -> WilayaIndex:
+        """Index of all the accepted spellings of the wilayas, built on first access"""
+        if self._aliases is None:
+            self._aliases = WilayaIndex(self.names, self.wilayas, settings.wilaya_aliases.fuzzy_max_distance)
+        return self._aliases
+
+    @property
+    def locator(self) -> WilayaLocator:
+        """Spatial index of the wilayas, built on first access"""
+        if self._locator is None:
+            self._locator = WilayaLocator(self.aliases, read_locations(), settings.geo.cell_size, settings.geo.bounds)
+        return self._locator
+
+    def find_day(self, day: date) -> Optional[int]:
+        """Return the position of the day on the date axis, None if it's not covered"""
+        day = np.datetime64(day, 'D')
+        position = int(np.searchsorted(self.dates, day))
+        if position < len(self.dates) and self.dates[position] == day:
+            return position
+        return None
+
+    def filter_days(self, days: Optional[Iterable[date]] = None, from_: Optional[date] = None, to: Optional[date] = None) -> np.ndarray:
+        """
+        Return the positions of the matching days on the date axis.
+
+        The date axis is sorted, so both the specific `days` and the `from_`/`to`
+        window (both inclusive, None means unbounded) are found by binary search.
+        """
+        if days is not None:
+            days = np.unique(np.array(days, dtype='datetime64[D]'))
+            positions = np.searchsorted(self.dates, days)
+            found = positions < len(self.dates)
+            found[found] = self.dates[positions[found]] == days[found]
+            return positions[found]
+
+        start = 0 if from_ is None else int(np.searchsorted(self.dates, np.datetime64(from_, 'D'), side='left'))
+        stop = len(self.dates) if to is None else int(np.searchsorted(self.dates, np.datetime64(to, 'D'), side='right'))
+        return np.arange(start, max(start, stop))
+
+    def filter_wilayas(self, codes_or_names: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Return the positions of the given wilayas (in order), all of them when None"""
+        if codes_or_names is None:
+            return np.arange(len(self.names))
+        return np.array(self.aliases.resolve_all(codes_or_names), dtype=np.intp)
+
+    def iter_records(self, wilaya_positions: np.ndarray, day_positions: np.ndarray, salat_positions: Optional[List[int]] = None, layout: Layout = LAYOUTS['ar'], wilaya_value=None, offset: int = 0) -> Iterator[dict]:
+        """
+        Generate the result rows for the given positions, ordered by date then wilaya, named after the `layout`.
+
+        `offset` is the index of the first row to generate, `wilaya_value` maps a wilaya position
+        to the value of the wilaya column, it defaults to the wilaya name.
+        """
+        if wilaya_value is None:
+            wilaya_value = self.names.__getitem__
+
+        if salat_positions is None:
+            salat_positions = range(len(layout.salawat))
+        salawat = [(layout.salawat[position], position) for position in salat_positions]
+
+        n_wilayas = len(wilaya_positions)
+        if n_wilayas == 0:
+            return
+
+        wilayas = [(wilaya, wilaya_value(wilaya)) for wilaya in wilaya_positions.tolist()]
+        first_day, first_wilaya = divmod(offset, n_wilayas)
+        for day in day_positions[first_day:].tolist():
+            day_date = self.dates[day].item()
+            # one read per day for all the wilayas
+            minutes = self.minutes[wilaya_positions, day].tolist()
+            for (wilaya, value), wilaya_minutes in list(zip(wilayas, minutes))[first_wilaya:]:
+                row = {
+                    layout.date: day_date,
+                    layout.wilaya: value,
+                }
+                for name, position in salawat:
+                    row[name] = MINUTE_STRINGS[wilaya_minutes[position]]
+                yield row
+            first_wilaya = 0
+
+    def records(self, wilaya_positions: np.ndarray, day_positions: np.ndarray, salat_positions: Optional[List[int]] = None, layout: Layout = LAYOUTS['ar'], wilaya_value=None, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+        """List `limit` result rows starting from `offset`, see `iter_records`"""
+        rows = self.iter_records(wilaya_positions, day_positions, salat_positions, layout, wilaya_value, offset)
+        return list(islice(rows, limit))
+
+    def row_position(self, wilaya_positions: np.ndarray, day_positions: np.ndarray, day: date, wilaya: int) -> int:
+        """Index of the row of (day, wilaya) in the rows ordered by date then wilaya, or of the row following it"""
+        day_index = int(np.searchsorted(self.dates[day_positions], np.datetime64(day, 'D')))
+        wilaya_index = 0
+        if day_index < len(day_positions) and self.dates[day_positions[day_index]] == np.datetime64(day, 'D'):
+            matches = np.flatnonzero(wilaya_positions == wilaya)
+            wilaya_index = int(matches[0]) if len(matches) else 0
+        return day_index * len(wilaya_positions) + wilaya_index
+
+    def row_at(self, wilaya_positions: np.ndarray, day_positions: np.ndarray, position: int) -> Optional[Tuple[date, int]]:
+        """(day, wilaya position) of the row at `position` in the rows ordered by date then wilaya"""
+        if position >= len(wilaya_positions) * len(day_positions):
+            return None
+        day_index, wilaya_index = divmod(position, len(wilaya_positions))
+        return self.dates[day_positions[day_index]].item(), int(wilaya_positions[wilaya_index])
+
+    def next_salawat(self, wilaya_positions: np.ndarray, now: datetime, n: Optional[int] = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find the salawat following `now` for all the given wilayas at once.
+
+        Return the (wilaya, day, salat) positions of the next `n` salawat of every wilaya,
+        or all the remaining salawat of the day when `n` is None. After icha, the next
+        salawat are the ones of the following day. Wilayas without data for the day are skipped.
+        """
+        wilaya_positions = np.asarray(wilaya_positions, dtype=np.intp)
+        empty = np.array([], dtype=np.intp)
+        today = self.find_day(now.date())
+        if today is None or len(wilaya_positions) == 0:
+            return empty, empty, empty
+
+        # the times of a day are increasing, shifting each wilaya by a day makes the
+        # whole (wilaya, salat) block sorted so one searchsorted finds all the next salawat
+        n_wilayas, n_salawat = len(wilaya_positions), self.minutes.shape[2]
+        offsets = np.arange(n_wilayas) * DAY_MINUTES
+        shifted = (self.minutes[wilaya_positions, today].astype(np.int32) + offsets[:, None]).ravel()
+        now_minutes = now.hour * 60 + now.minute
+        first = np.searchsorted(shifted, offsets + now_minutes, side='right') - np.arange(n_wilayas) * n_salawat
+
+        # roll over to the fajr of the following day
+        rolled = first == n_salawat
+        days = np.where(rolled, today + 1, today)
+        first = np.where(rolled, 0, first)
+        counts = n_salawat - first if n is None else np.minimum(n, n_salawat - first)
+        counts = np.where(days < len(self.dates), counts, 0)
+
+        # expand to one position per salat
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        salat_positions = np.repeat(first, counts) + np.arange(counts.sum()) - starts
+        return np.repeat(wilaya_positions, counts), np.repeat(days, counts), salat_positions
+
+    def cells_records(self, wilaya_positions: np.ndarray, day_positions: np.ndarray, salat_positions: np.ndarray, layout: Layout = LAYOUTS['ar'], wilaya_value=None) -> List[dict]:
+        """Build the result rows of (wilaya, day, salat) positions, consecutive cells of the same wilaya and day share a row"""
+        if wilaya_value is None:
+            wilaya_value = self.names.__getitem__
+
+        minutes = self.minutes[wilaya_positions, day_positions, salat_positions].tolist()
+        cells = zip(wilaya_positions.tolist(), day_positions.tolist(), salat_positions.tolist(), minutes)
+        rows = []
+        previous = None
+        for wilaya, day, salat, salat_minutes in cells:
+            if (wilaya, day) != previous:
+                row = {
+                    layout.date: self.dates[day].item(),
+                    layout.wilaya: wilaya_value(wilaya),
+                }
+                rows.append(row)
+                previous = (wilaya, day)
+            row[layout.salawat[salat]] = MINUTE_STRINGS[salat_minutes]
+
+        return rows
+
+
+def read_store(directory: str, wilayas: Optional[Iterable[dict]] = None) -> MawaqitStore:
+    # pandas is only needed to parse the CSVs, the workers load the compiled snapshot
+    import pandas as pd
+
+    if wilayas is None:
+        wilayas = read_wilayas()
+
+    names = []
+    dates = None
+    minutes = []
+    for f in sorted(os.listdir(directory)):
+        path = os.path.join(directory, f)
+        name = Path(path).stem
+        mawaqit = pd.read_csv(path, index_col=False, dtype=str)
+
+        wilaya_dates = np.array(mawaqit[settings.column_names.date].apply(str_to_date), dtype='datetime64[D]')
+        if dates is None:
+            dates = wilaya_dates
+        elif not np.array_equal(dates, wilaya_dates):
+            raise ValueError(f'Mawaqit of {name} do not cover the same days as the other wilayas')
+
+        names.append(name)
+        minutes.append(np.stack([time_to_minutes(mawaqit[salat]) for salat in settings.salawat_names], axis=-1))
+
+    order = np.argsort(dates, kind='stable')
+    minutes = np.stack(minutes)[:, order]
+    wilayas = [get_wilaya(name, wilayas) for name in names]
+    logger.info(f'Read mawaqit of {len(names)} wilayas for {len(dates)} days from {directory}')
+    return MawaqitStore(names, wilayas, dates[order], minutes)
+
+
+_store: Optional[MawaqitStore] = None
+# store a request started with, a reload swapping the dataset doesn't change the one of the requests in flight
+_request_store: ContextVar = ContextVar('request_store', default=None)
+
+
+def load_store(directory: Optional[str] = None, snapshot_file: Optional[str] = None) -> MawaqitStore:
+    """
+    Load the store from the compiled snapshot when it is available and up to date,
+    fallback to parsing the CSVs (and compiling the snapshot for the next workers) otherwise.
+    Raise a DatasetError when the dataset doesn't pass the validation.
+    """
+    # imported here to avoid a circular import, the snapshot module builds stores
+    from .snapshot import SnapshotError, is_stale, load_snapshot, write_snapshot
+
+    directory = directory or settings.mawaqit_for_wilayas_dir
+    snapshot_file = snapshot_file or settings.snapshot_file
+    start = time.perf_counter()
+
+    if os.path.exists(snapshot_file):
+        try:
+            if not is_stale(snapshot_file, directory):
+                store = load_snapshot(snapshot_file)
+                validate(store).raise_for_violations()
+                store.load_seconds = time.perf_counter() - start
+                return store
+            logger.warning(f'Snapshot {snapshot_file} is older than its sources, reading the CSVs')
+        except SnapshotError as e:
+            logger.warning(f'Cannot load snapshot {snapshot_file}: {e}')
+
+    store = read_store(directory)
+    # never serve, nor compile, an invalid dataset
+    validate(store).raise_for_violations()
+    try:
+        write_snapshot(store, snapshot_file)
+    except OSError as e:
+        logger.warning(f'Cannot write snapshot {snapshot_file}: {e}')
+    store.load_seconds = time.perf_counter() - start
+    return store
+
+
+def get_store() -> MawaqitStore:
+    """Store of the current request, the process-wide store, loaded on first access, out of requests"""
+    store = _request_store.get()
+    if store is not None:
+        return store
+    global _store
+    if _store is None:
+        _store = load_store()
+    return _store
+
+
+def swap_store(store: MawaqitStore):
+    """Serve `store` from now on, the requests in flight keep theirs"""
+    global _store
+    _store = store
+
+
+def pin_store():
+    """Keep the current store for the rest of the request"""
+    _request_store.set(None)
+    _request_store.set(get_store())
+
+
+def unpin_store(exc: Optional[BaseException] = None):
+    _request_store.set(None)
+
+
+def validate_wilaya(code_or_name: str):
+    """marshmallow validator of the wilayas of the current store"""
+    get_store().aliases.validate(code_or_name)
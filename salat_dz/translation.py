@@ -0,0 +1,92 @@
+"""
+Translation tables compiled once from the settings.
+
+Every language `xx` listed in `settings.languages` provides its `column_names_xx` and `salawat_xx`
+(arabic, the reference language, uses `column_names` and `salawat`). Requests only read the frozen
+tables compiled here, adding a language costs nothing at request time.
+"""
+from collections import OrderedDict
+import logging
+from types import MappingProxyType
+from typing import Dict, Mapping, NamedTuple, Tuple
+
+from flask_restx.fields import Date, Raw
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_KEYS = ('column_names', 'salawat')
+
+
+class Layout(NamedTuple):
+    """Names of the response columns in one language, salawat are in chronological order"""
+    language: str
+    date: str
+    wilaya: str
+    salawat: Tuple[str, ...]
+
+    def model_fields(self, wilaya: Raw, salat: type) -> Dict[str, Raw]:
+        """Fields of the swagger model of this layout"""
+        fields = OrderedDict()
+        fields[self.date] = Date()
+        fields[self.wilaya] = wilaya
+        for name in self.salawat:
+            fields[name] = salat()
+        return fields
+
+
+def get_settings(key, language='ar'):
+    if language == 'ar':
+        language = ''
+
+    if language:
+        key = f'{key}_{language}'
+
+    return getattr(settings, key, None)
+
+
+def compile_names(language: str) -> Mapping[str, str]:
+    """Map the keys (date, fajr, ...) to their names in the language"""
+    names = {}
+    for settings_key in SETTINGS_KEYS:
+        settings_value = get_settings(settings_key, language)
+        if settings_value is None:
+            raise ValueError(f'{settings_key} are not translated to {language}')
+        names.update(dict(settings_value))
+    return MappingProxyType(names)
+
+
+# keys of the salawat in chronological order
+SALAWAT_KEYS = tuple({name: key for key, name in settings.salawat.items()}[name] for name in settings.salawat_names)
+# position of the salawat (arabic names) in the chronological order
+SALAT_POSITIONS: Mapping[str, int] = MappingProxyType({name: position for position, name in enumerate(settings.salawat_names)})
+
+NAMES: Mapping[str, Mapping[str, str]] = MappingProxyType({
+    language: compile_names(language) for language in settings.languages
+})
+
+TRANSLATIONS: Mapping[Tuple[str, str], Mapping[str, str]] = MappingProxyType({
+    (from_, to): MappingProxyType({NAMES[from_][key]: NAMES[to][key] for key in NAMES[from_] if key in NAMES[to]})
+    for from_ in NAMES for to in NAMES
+})
+
+LAYOUTS: Mapping[str, Layout] = MappingProxyType({
+    language: Layout(
+        language=language,
+        date=names['date'],
+        wilaya=names['wilaya'],
+        salawat=tuple(names[key] for key in SALAWAT_KEYS),
+    )
+    for language, names in NAMES.items()
+})
+
+
+def translate(name, from_='ar', to='en'):
+    if from_ == to:
+        return name
+
+    translated = TRANSLATIONS[from_, to].get(name)
+    if translated is None:
+        logger.warning(f'Cannot translate {name} from {from_} to {to}')
+    return translated
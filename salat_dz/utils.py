@@ -1,34 +1,60 @@
 from operator import itemgetter
-import os
 import json
 import logging
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from typing import Iterable, List, Optional
 from marshmallow.fields import Field
 from pytz import timezone
-from pathlib import Path
 
 from flask_restx.fields import MarshallingError, Raw
 from datetime import datetime, time
 from webargs.core import ArgMap, Parser
 from werkzeug.routing import BaseConverter, ValidationError
-from geopy.geocoders import Nominatim
-import pandas as pd
-import Levenshtein as lev
 
 from .config import settings
-from .reader import str_to_date
 
 logger = logging.getLogger(__name__)
 
 
 DZ = timezone('Africa/Algiers')
+
+
+def str_to_date(s):
+    # in the djelfa.pdf there a typo in this day, see page number 10
+    if s == '2020-04-17':
+        s = '2021-04-17'
+    if s == '03-09-2020':
+        s = '2020-09-03'
+    return date.fromisoformat(s.replace('/', '-'))
+
+
 def today(tz=DZ):
     dt_now = datetime.now(tz=tz)
     today = dt_now.date()
     return today.isoformat()
 
 
+def date_window(from_: Optional[date], to: Optional[date], n_days: Optional[timedelta], n_weeks: Optional[timedelta], today: date):
+    """
+    Return the inclusive (from_, to) bounds of the requested dates, `to` is None when there is no upper bound.
+
+    * no filter: today
+    * `from_` and/or `to`: the interval, `from_` defaults to today
+    * `n_days` and/or `n_weeks`: that many days starting from `from_`
+    """
+    if not (from_ or to or n_days or n_weeks):
+        return today, today
+
+    if not from_:
+        from_ = today
+
+    if not to and (n_days or n_weeks):
+        duration = (n_days or timedelta()) + (n_weeks or timedelta())
+        to = from_ + duration - timedelta(days=1)
+
+    return from_, to
+
+
 def argmap_to_swagger_params(argmap: ArgMap, req=None):
     parser = Parser()
     schema = parser._get_schema(argmap, req)
@@ -47,17 +73,6 @@ def field_to_type(field: Field):
     return field.__class__.__name__.lower()
 
 
-
-def read_mawaqit_for_wilayas(directory):
-    mawaqit_for_wilayas = {}
-    for f in os.listdir(directory):
-        path = os.path.join(directory, f)
-        wilaya = Path(path).stem
-        mawaqit_for_wilayas[wilaya] = pd.read_csv(path, index_col=False)
-
-    return mawaqit_for_wilayas
-
-
 def read_wilayas():
     with open(settings.wilayas_file) as f:
         return json.load(f)
@@ -98,6 +113,9 @@ def look_for_rename(old_names: List[str], wilayas: Iterable[dict], path: str):
 
 
 def best_match(name: str, names: Iterable[str]):
+    # imported here, only the maintenance commands look for best matches
+    import Levenshtein as lev
+
     distances = []
     for other_name in names:
         distance = lev.distance(name, other_name)
@@ -107,56 +125,6 @@ def best_match(name: str, names: Iterable[str]):
     return best, minimum_distance
 
 
-
-def read_mawaqit_for_wilayas_v2(directory):
-    mawaqit_for_wilayas = []
-    for f in os.listdir(directory):
-        path = os.path.join(directory, f)
-        arabic_name = Path(path).stem
-
-        wilaya = get_wilaya(arabic_name)
-
-        mawaqit_for_wilayas.append((wilaya, pd.read_csv(path, index_col=False)))
-       
-    return mawaqit_for_wilayas
-
-
-def get_wilayas_values(wilayas):
-    arabic_names = [w['arabic_name'] for w in wilayas]
-    french_names = [w['english_name'] for w in wilayas]
-    codes = [w['code'] for w in wilayas]
-    accepted_values = arabic_names + french_names + codes
-    return accepted_values
-    
-
-
-def create_mawaqits(mawaqit_for_wilayas, wilaya_column_name):
-    dfs = []
-    for wilaya, mawaqit in mawaqit_for_wilayas.items():
-        mawaqit[wilaya_column_name] = wilaya
-        dfs.append(mawaqit)
-
-    mawaqits = pd.concat(dfs)
-
-    mawaqits[settings.column_names.date] = mawaqits[settings.column_names.date].apply(str_to_date)
-    mawaqits.index = mawaqits[settings.column_names.date]
-    return mawaqits
-
-
-def create_mawaqits_v2(mawaqit_for_wilayas, wilaya_column_name):
-    dfs = []
-    for wilaya, mawaqit in mawaqit_for_wilayas:
-        mawaqit[wilaya_column_name] = [wilaya]*len(mawaqit)
-        dfs.append(mawaqit)
-
-    mawaqits = pd.concat(dfs)
-
-    mawaqits[settings.column_names.date] = mawaqits[settings.column_names.date].apply(str_to_date)
-    mawaqits.index = mawaqits[settings.column_names.date]
-    return mawaqits
-
-
-
 class Time(Raw):
     """
     Return a formatted time string in %H:%M.
@@ -193,64 +161,13 @@ class Time(Raw):
 
 
 def get_wilaya_from_geopos(latitude, longitude):
-    geolocator = Nominatim(user_agent=settings.user_agent)
-    address = geolocator.reverse(f'{latitude}, {longitude}')
-    state = address.raw['address']['state']
-    wilaya_ar = state.split()[-1]
-    return wilaya_ar
-
-
-def get_settings(key, language='ar'):
-    if language == 'ar':
-        language = ''
-
-    if language:
-        key = f'{key}_{language}'
-
-    return getattr(settings, key, None)
-
-
-def translate(name, from_='ar', to='en'):
-    if from_ == to:
-        return name
-
-    settings_keys = ['column_names', 'salawat']
-    translated = None
-    for settings_key in settings_keys:
-        settings_value = get_settings(settings_key, from_)
-        # Make sure the settings_value is a dict
-        try:
-            dict(settings_value)
-        except ValueError:
-            logger.warning(f'translate: settings_value of {settings_key} is not dict')
-            continue
-
-        value_to_key = {value: key for key, value in settings_value.items()}
-        if name in value_to_key:
-            key = value_to_key[name]
-            translation = get_settings(settings_key, to)
-            if translation:
-                translated = getattr(translation, key, None)
-                break
-
-    if not translated:
-        logger.warning(f'Cannot translate {name} from {from_} to {to}')
-    else:
-        logger.info(f'{name} translated from {from_} to {to}: {translated}')
-
-    return translated
-
-
-def next_salawat(mawaqit: dict, n: Optional[int] = 1):
-    dt_now = datetime.now(tz=DZ)
-    now = dt_now.time()
-
-    nexts = []
-    for salat_name, salat_time in mawaqit.items():
-        if time.fromisoformat(salat_time) > now:
-            nexts.append(salat_name)
+    """Arabic name of the closest wilaya, found in the bundled locations without any network call"""
+    # the store imports this module
+    from .store import get_store
 
-        if n and len(nexts) == n:
-            break
+    store = get_store()
+    position = store.locator.locate(latitude, longitude)
+    if position is None:
+        return None
+    return store.wilayas[position]['arabic_name']
 
-    return nexts
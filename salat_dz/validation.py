@@ -0,0 +1,144 @@
+"""
+Validation of the whole dataset, every check is an array operation over all the wilayas at once.
+
+* the dates are consecutive and cover a (hijri) year, see `settings.validation.days`
+* the times are within a day and the salawat are in chronological order
+* the times don't jump from a day to the next by more than `settings.validation.max_daily_change` minutes
+* no wilaya is further than `settings.validation.max_offset` minutes from the median of all the wilayas,
+  which catches wrong regional diffs
+
+The build fails on violations and the workers refuse to serve a dataset that has some.
+Usage: python -m salat_dz.validation
+"""
+import logging
+import sys
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+DAY_MINUTES = 24 * 60
+# cells listed in a violation message, the count is always exact
+MAX_EXAMPLES = 5
+
+
+class DatasetError(ValueError):
+    pass
+
+
+class Violation(NamedTuple):
+    check: str
+    count: int
+    examples: List[str]
+
+    def __str__(self):
+        return f'{self.check}: {self.count} violation(s), e.g. {"; ".join(self.examples)}'
+
+
+class ValidationReport(NamedTuple):
+    n_wilayas: int
+    n_days: int
+    violations: List[Violation]
+
+    @property
+    def ok(self) -> bool:
+        return not self.violations
+
+    def __str__(self):
+        lines = [f'{self.n_wilayas} wilayas, {self.n_days} days: {"ok" if self.ok else "invalid"}']
+        lines.extend(f'  {violation}' for violation in self.violations)
+        return '\n'.join(lines)
+
+    def raise_for_violations(self):
+        if not self.ok:
+            raise DatasetError(f'Invalid dataset\n{self}')
+
+
+def date_gaps(dates: np.ndarray) -> np.ndarray:
+    """Positions of the dates not followed by the next day"""
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    return np.flatnonzero(np.diff(dates) != np.timedelta64(1, 'D'))
+
+
+def check_dates(dates: np.ndarray, days: Optional[Sequence[int]] = None) -> List[Violation]:
+    violations = []
+    gaps = date_gaps(dates)
+    if len(gaps):
+        examples = [f'{dates[i]} -> {dates[i + 1]}' for i in gaps[:MAX_EXAMPLES]]
+        violations.append(Violation('consecutive days', len(gaps), examples))
+
+    if days is not None:
+        min_days, max_days = days
+        if not min_days <= len(dates) <= max_days:
+            violations.append(Violation('complete year', 1, [f'{len(dates)} days, expected {min_days} to {max_days}']))
+    return violations
+
+
+def hhmm(minutes: int) -> str:
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def cell_examples(names: Sequence[str], dates: np.ndarray, cells: tuple, describe) -> List[str]:
+    return [
+        f'{names[wilaya]} {dates[day]} {describe(wilaya, day, salat)}'
+        for wilaya, day, salat in list(zip(*cells))[:MAX_EXAMPLES]
+    ]
+
+
+def check_minutes(names: Sequence[str], dates: np.ndarray, minutes: np.ndarray,
+                  max_daily_change: Optional[int] = None, max_offset: Optional[int] = None) -> List[Violation]:
+    violations = []
+    salawat = settings.salawat_names
+    minutes = minutes.astype(np.int32)
+
+    out_of_day = np.nonzero((minutes < 0) | (minutes >= DAY_MINUTES))
+    if len(out_of_day[0]):
+        examples = cell_examples(names, dates, out_of_day, lambda w, d, s: f'{salawat[s]}={minutes[w, d, s]} minutes')
+        violations.append(Violation('times within a day', len(out_of_day[0]), examples))
+
+    unordered = np.nonzero(np.diff(minutes, axis=-1) <= 0)
+    if len(unordered[0]):
+        examples = cell_examples(names, dates, unordered, lambda w, d, s: f'{salawat[s]}={hhmm(minutes[w, d, s])} >= {salawat[s + 1]}={hhmm(minutes[w, d, s + 1])}')
+        violations.append(Violation('chronological salawat', len(unordered[0]), examples))
+
+    if max_daily_change is not None and minutes.shape[1] > 1:
+        jumps = np.nonzero(np.abs(np.diff(minutes, axis=1)) > max_daily_change)
+        if len(jumps[0]):
+            examples = cell_examples(names, dates, jumps, lambda w, d, s: f'{salawat[s]} {hhmm(minutes[w, d, s])} -> {hhmm(minutes[w, d + 1, s])}')
+            violations.append(Violation('daily change', len(jumps[0]), examples))
+
+    if max_offset is not None and minutes.shape[0] > 1:
+        median = np.median(minutes, axis=0)
+        far = np.nonzero(np.abs(minutes - median) > max_offset)
+        if len(far[0]):
+            examples = cell_examples(names, dates, far, lambda w, d, s: f'{salawat[s]}={hhmm(minutes[w, d, s])}, median={hhmm(int(median[d, s]))}')
+            violations.append(Violation('offset from the other wilayas', len(far[0]), examples))
+    return violations
+
+
+def validate(store) -> ValidationReport:
+    """Run all the checks on a store, configured by `settings.validation`"""
+    config = settings.validation
+    violations = check_dates(store.dates, config.days)
+    violations.extend(check_minutes(store.names, store.dates, store.minutes, config.max_daily_change, config.max_offset))
+    report = ValidationReport(len(store.names), len(store.dates), violations)
+    if not report.ok:
+        logger.error(str(report))
+    return report
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    # imported here, the store imports this module
+    from .store import read_store
+
+    report = validate(read_store(settings.mawaqit_for_wilayas_dir))
+    print(report)
+    sys.exit(0 if report.ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import re
+import logging
+import unicodedata
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from marshmallow import ValidationError
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+ARABIC_DIACRITICS = re.compile('[\u0640\u064b-\u065f\u0670]')
+ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    'ئ': 'ي',
+    'ى': 'ي',
+    'ة': 'ه',
+})
+SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(name: str) -> str:
+    """
+    Normalize a wilaya name so the spelling variants map to the same form:
+    arabic diacritics and alef/hamza variants, latin accents and case, punctuation and whitespace.
+    """
+    name = unicodedata.normalize('NFKC', name)
+    name = ARABIC_DIACRITICS.sub('', name).translate(ARABIC_LETTERS)
+    name = ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+    name = SEPARATORS.sub(' ', name.casefold())
+    return name.strip()
+
+
+class BKTree:
+    """Burkhard-Keller tree, finds the words within a given distance without comparing to all of them"""
+
+    def __init__(self, distance: Optional[Callable[[str, str], int]] = None):
+        if distance is None:
+            # imported here, only the fuzzy lookups need it
+            import Levenshtein as lev
+
+            distance = lev.distance
+        self.distance = distance
+        self.root: Optional[Tuple[str, Dict[int, tuple]]] = None
+
+    def add(self, word: str):
+        if self.root is None:
+            self.root = (word, {})
+            return
+
+        node_word, children = self.root
+        while True:
+            distance = self.distance(word, node_word)
+            if distance == 0:
+                return
+            if distance not in children:
+                children[distance] = (word, {})
+                return
+            node_word, children = children[distance]
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Return the (distance, word) within max_distance of word, closest first"""
+        found = []
+        candidates = [self.root] if self.root else []
+        while candidates:
+            node_word, children = candidates.pop()
+            distance = self.distance(word, node_word)
+            if distance <= max_distance:
+                found.append((distance, node_word))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    candidates.append(child)
+
+        return sorted(found)
+
+
+class WilayaIndex:
+    """
+    Maps every accepted spelling of a wilaya to its position in the store:
+    codes, names found in the ministry PDFs, arabic and english names, `settings.rename` entries,
+    and their normalized forms. Unknown names fallback to a fuzzy lookup.
+    """
+
+    def __init__(self, names: List[str], wilayas: List[dict], max_distance: int = 2):
+        self.max_distance = max_distance
+        self.aliases: Dict[str, Optional[int]] = {}
+        self.normalized: Dict[str, Optional[int]] = {}
+        self._tree: Optional[BKTree] = None
+
+        # read once, every settings access goes through dynaconf
+        rename = dict(settings.rename)
+        renamed_from = {new_name: old_name for old_name, new_name in rename.items()}
+        for position, (name, wilaya) in enumerate(zip(names, wilayas)):
+            aliases = {name, wilaya['code'], wilaya['arabic_name'], wilaya['english_name']}
+            if name in rename:
+                aliases.add(rename[name])
+            if wilaya['arabic_name'] in renamed_from:
+                aliases.add(renamed_from[wilaya['arabic_name']])
+            if wilaya['code'].isdigit():
+                aliases.add(str(int(wilaya['code'])))
+
+            for alias in aliases:
+                self._add(self.aliases, alias, position)
+                self._add(self.normalized, normalize(alias), position)
+
+    @property
+    def tree(self) -> BKTree:
+        """BK-tree of the normalized names, built on the first fuzzy lookup, most lookups are exact"""
+        if self._tree is None:
+            tree = BKTree()
+            for alias in self.normalized:
+                if not alias.isdigit():
+                    tree.add(alias)
+            self._tree = tree
+        return self._tree
+
+    @staticmethod
+    def _add(index: Dict[str, Optional[int]], alias: str, position: int):
+        if index.get(alias, position) != position:
+            logger.warning(f'Wilaya alias {alias!r} is ambiguous, ignoring it')
+            index[alias] = None
+        elif alias not in index:
+            index[alias] = position
+
+    def is_ambiguous(self, code_or_name: str) -> bool:
+        """Whether it's an alias of several wilayas"""
+        if code_or_name in self.aliases:
+            return self.aliases[code_or_name] is None
+        return self.normalized.get(normalize(code_or_name), -1) is None
+
+    def resolve(self, code_or_name: str) -> Optional[int]:
+        """Return the position of the wilaya or None if no wilaya matches, or if it's an alias of several wilayas"""
+        # an ambiguous alias is an exact hit too, it must not fuzzy match one of its wilayas or a neighbouring one
+        if code_or_name in self.aliases:
+            return self.aliases[code_or_name]
+
+        normalized = normalize(code_or_name)
+        if normalized in self.normalized:
+            return self.normalized[normalized]
+
+        # don't let short inputs fuzzy match everything
+        max_distance = min(self.max_distance, len(normalized) // 3)
+        for distance, alias in self.tree.search(normalized, max_distance):
+            position = self.normalized[alias]
+            if position is not None:
+                logger.debug(f'Wilaya {code_or_name!r} fuzzy matched {alias!r} at distance {distance}')
+                return position
+
+        return None
+
+    def resolve_all(self, codes_or_names: Iterable[str]) -> List[int]:
+        return [self.resolve(code_or_name) for code_or_name in codes_or_names]
+
+    def validate(self, code_or_name: str):
+        """marshmallow validator"""
+        if self.resolve(code_or_name) is None:
+            if self.is_ambiguous(code_or_name):
+                raise ValidationError(f'Ambiguous wilaya {code_or_name}, use its code')
+            raise ValidationError(f'Unknown wilaya {code_or_name}')
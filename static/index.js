@@ -1,4 +1,7 @@
 const API_URL = "/api/v1/mawaqit";
+const STREAM_URL = "/api/v2/mawaqit/stream";
+const BUNDLE_URL = "/api/v2/mawaqit/";
+const DAY_MILLISECONDS = 24 * 60 * 60 * 1000;
 const SAVE_URL = "/save";
 const SALAWAT_NAMES = {
     "fajr": "الفجر",
@@ -11,7 +14,16 @@ const SALAWAT_NAMES = {
 const DATE_COLUMN = "الموافق";
 const WILAYA_COLUMN = "الولاية";
 const DATE_FORMAT = "yyyy-mm-dd";
-const GEO_API_URL = "https://nominatim.openstreetmap.org/reverse";
+// the mawaqit are in the time of Algeria, whatever the timezone of the browser
+const ALGIERS_TIME = new Intl.DateTimeFormat("en-CA", {
+    timeZone: "Africa/Algiers",
+    year: "numeric",
+    month: "2-digit",
+    day: "2-digit",
+    hour: "2-digit",
+    minute: "2-digit",
+    hourCycle: "h23",
+});
 
 // keep track of wilaya got from geo API to avoid sending requests if the wilaya didn't change
 var geolocated_wilaya;
@@ -19,6 +31,15 @@ var geolocated_wilaya;
 // keep track of current selected params to avoid sending requests if user selects the same values
 var current_params = {};
 
+// mawaqit shown and arabic name of the next salat, pushed by the server when the previous one arrives,
+// counted locally from the bundle when the server doesn't hold event streams (EVENT_STREAMS is set by the page)
+var current_mawaqit;
+var next_salat;
+var next_salat_source;
+
+// decoded season bundles of the wilayas already shown, the browser revalidates them with their ETag
+var bundles = {};
+
 async function fetchOneMawaqit(params) {
     let searchParams = new URLSearchParams(params);
     let url = API_URL + "?" + searchParams.toString();
@@ -27,27 +48,105 @@ async function fetchOneMawaqit(params) {
         .catch(function (error) {
             console.error(error);
         });
+    if (response === undefined) {
+        return undefined;
+    }
     let mawaqit_list = await response.json();
     let mawaqit = mawaqit_list[0];
     return mawaqit;
 }
 
-async function fetchNextSalat(wilaya) {
-    let params = {
-        wilayas: wilaya,
-        salawat: 'next',
-    };
-    let mawaqit = await fetchOneMawaqit(params);
+function decodeBundle(bundle) {
+    // every salat is its minutes on the first day followed by the daily changes
+    let minutes = {};
+    for (const englishName in bundle.salawat) {
+        let total = 0;
+        minutes[englishName] = bundle.salawat[englishName].map((delta) => total += delta);
+    }
+    return { first_day: Date.parse(bundle.first_day), days: bundle.days, minutes: minutes };
+}
 
-    delete mawaqit[DATE_COLUMN];
-    delete mawaqit[WILAYA_COLUMN];
+function fetchBundle(wilaya) {
+    if (!(wilaya in bundles)) {
+        let url = BUNDLE_URL + encodeURIComponent(wilaya) + "/bundle";
+        bundles[wilaya] = fetch(url)
+            .then((response) => response.json())
+            .then(decodeBundle)
+            .catch(function (error) {
+                console.error(error);
+                delete bundles[wilaya];
+            });
+    }
+    return bundles[wilaya];
+}
 
-    let keys = Object.keys(mawaqit);
-    if (keys.length == 1) {
-        return keys[0];
-    } else {
+// position of a day in the bundle, undefined when the day is out of its season
+function bundleDay(bundle, date) {
+    let day = Math.round((Date.parse(date) - bundle.first_day) / DAY_MILLISECONDS);
+    return day >= 0 && day < bundle.days ? day : undefined;
+}
+
+// mawaqit of a day from the bundle, undefined when the day is out of its season
+function bundleMawaqit(bundle, date) {
+    let day = bundleDay(bundle, date);
+    if (day === undefined) {
+        return undefined;
+    }
+    let mawaqit = {};
+    for (const englishName in bundle.minutes) {
+        let minutes = bundle.minutes[englishName][day];
+        let hours = Math.floor(minutes / 60);
+        mawaqit[SALAWAT_NAMES[englishName]] = `${String(hours).padStart(2, "0")}:${String(minutes % 60).padStart(2, "0")}`;
+    }
+    return mawaqit;
+}
+
+// date and minutes since midnight of now in Algeria
+function algiersNow() {
+    let parts = {};
+    for (const part of ALGIERS_TIME.formatToParts(new Date())) {
+        parts[part.type] = part.value;
+    }
+    return {
+        date: `${parts.year}-${parts.month}-${parts.day}`,
+        minutes: (Number(parts.hour) % 24) * 60 + Number(parts.minute),
+    };
+}
+
+// arabic name of the next salat of today from the bundle, undefined after icha or out of its season
+async function localNextSalat(wilaya) {
+    let bundle = await fetchBundle(wilaya);
+    let now = algiersNow();
+    let day = bundle && bundleDay(bundle, now.date);
+    if (day === undefined) {
         return undefined;
     }
+    for (const englishName in SALAWAT_NAMES) {
+        if (bundle.minutes[englishName][day] > now.minutes) {
+            return SALAWAT_NAMES[englishName];
+        }
+    }
+    return undefined;
+}
+
+function followNextSalat(wilaya) {
+    if (next_salat_source !== undefined) {
+        next_salat_source.close();
+    }
+    let searchParams = new URLSearchParams({ wilayas: wilaya });
+    next_salat_source = new EventSource(STREAM_URL + "?" + searchParams.toString());
+    // sent on connection then every time a salat arrives, the browser reconnects by itself
+    next_salat_source.addEventListener("next", function (event) {
+        let mawaqit_list = JSON.parse(event.data);
+        next_salat = undefined;
+        if (mawaqit_list.length == 1) {
+            let salawat = Object.keys(mawaqit_list[0]).filter((key) => key in SALAWAT_NAMES);
+            next_salat = SALAWAT_NAMES[salawat[0]];
+        }
+        if (current_mawaqit !== undefined) {
+            updateMawaqit(current_mawaqit, next_salat);
+        }
+    });
 }
 
 async function saveWilaya() {
@@ -110,10 +209,9 @@ function updateMawaqit(mawaqit, nextSalat = undefined, salawat = SALAWAT_NAMES)
         if (arabicName == nextSalat) {
             let now = new Date();
 
+            // counted from the time of Algeria, the browser may be in another timezone
             let [hours, minutes] = mawaqit[arabicName].split(':');
-            let date = new Date(now.getTime());
-            date.setHours(hours);
-            date.setMinutes(minutes);
+            let date = new Date(now.getTime() + (Number(hours) * 60 + Number(minutes) - algiersNow().minutes) * 60000);
 
             let duration = dateDiff(now, date);
 
@@ -133,9 +231,22 @@ async function refreshMawaqit() {
     // Skip updating if params doens't changed
     if (JSON.stringify(params) !== JSON.stringify(current_params)) {
         console.log('Updating mawaqit for', params);
-        let mawaqit = await fetchOneMawaqit(params);
-        let nextSalat = await fetchNextSalat(wilaya);
-        updateMawaqit(mawaqit, nextSalat = nextSalat);
+        if (wilaya !== current_params.wilayas) {
+            next_salat = undefined;
+            if (EVENT_STREAMS) {
+                followNextSalat(wilaya);
+            }
+        }
+        // the days of the season are answered locally, the other ones by the api
+        let bundle = await fetchBundle(wilaya);
+        current_mawaqit = bundle && bundleMawaqit(bundle, date);
+        if (current_mawaqit === undefined) {
+            current_mawaqit = await fetchOneMawaqit(params);
+        }
+        if (!EVENT_STREAMS) {
+            next_salat = await localNextSalat(wilaya);
+        }
+        updateMawaqit(current_mawaqit, next_salat);
         current_params = params;
     }
 }
@@ -143,19 +254,16 @@ async function refreshMawaqit() {
 function getWilayaFromLocation() {
     if (geolocated_wilaya !== $("#wilaya").val()) {
         navigator.geolocation.getCurrentPosition(async function callback(position) {
-            params = new URLSearchParams({
+            // the closest wilaya is found by the api, without calling an external geocoder
+            let mawaqit = await fetchOneMawaqit({
                 lat: position.coords.latitude,
                 lon: position.coords.longitude,
-                format: "json",
-                "accept-language": "ar",
             });
-            let url = GEO_API_URL + '?' + params.toString();
-            let response = await fetch(url)
-                .catch(function (error) {
-                    console.error(error);
-                });
-            let response_object = await response.json();
-            let wilaya_name = response_object.address.state;
+            if (mawaqit === undefined) {
+                console.error("No wilaya found at", position.coords.latitude, position.coords.longitude);
+                return;
+            }
+            let wilaya_name = mawaqit[WILAYA_COLUMN];
             console.log("Setting wilaya to ", wilaya_name);
             $("#wilaya").selectpicker("val", wilaya_name).change();
             geolocated_wilaya = wilaya_name;
@@ -178,5 +286,14 @@ $(function () {
         value: today,
     });
     refreshMawaqit();
+    // the time left to the next salat is counted down locally, without requests
+    setInterval(async function () {
+        if (current_mawaqit !== undefined) {
+            if (!EVENT_STREAMS) {
+                next_salat = await localNextSalat(current_params.wilayas);
+            }
+            updateMawaqit(current_mawaqit, next_salat);
+        }
+    }, 60000);
     $('#saved-toast').toast({ delay: 2000 });
 });